@@ -0,0 +1,291 @@
+import heapq
+import json
+from operator import itemgetter
+from board import board_height, board_width
+from game import convert_shape_format, drop_piece, valid_space
+from movegen import reachable_placements
+
+# Weights of the evaluation functions
+#   bump, height, rows, gaps             - depth 1 value of the current piece
+#   next_bump, next_height, next_gaps    - value of a placement for the pieces after it
+#   next, move                           - how depth 2 adds up the next and the current value
+default_weights = {'bump': 1, 'height': 25, 'rows': 4, 'gaps': 5,
+                   'next_bump': 1, 'next_height': 5, 'next_gaps': 1,
+                   'next': 1, 'move': 2}
+weights = dict(default_weights)
+
+
+# Replace the weights in place, so every module that imported the dict sees the change
+def set_weights(new_weights):
+    weights.clear()
+    weights.update(default_weights)
+    weights.update(new_weights)
+
+
+# Load weights from a JSON config written by tune.py, missing keys keep their default
+def load_weights(path):
+    with open(path) as f:
+        set_weights(json.load(f))
+    return weights
+
+
+# Write weights as a JSON config that load_weights can read
+def save_weights(path, new_weights=None):
+    with open(path, 'w') as f:
+        json.dump(new_weights or weights, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# Data structure that stores the move a specific piece can make and the value it has
+# A move is a snapshot: it keeps the index of the piece instead of the piece the search moves around
+# The path holds the inputs that play the move, if the move generator found them
+class Move (object):
+    __slots__ = ('x', 'y', 'shape', 'rotation', 'value', 'index', 'path')
+
+    def __init__(self, x, y, shape, rotation, value, index, path=None):
+        self.shape = shape
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.value = value
+        self.index = index
+        self.path = path
+
+
+# Value of a (value, ...) candidate
+candidate_value = itemgetter(0)
+
+
+# Best k of a stream of (value, ...) candidates, the same ones sorted(...)[:k] returns
+# Only k candidates are kept at a time, k=None keeps and sorts all of them
+def select_top(candidates, k=None):
+    if k is None:
+        return sorted(candidates, key=candidate_value)
+    return heapq.nsmallest(k, candidates, key=candidate_value)
+
+
+# Heuristic helper function to calculate the maximum height of the current piece at the move
+def heur_height(current_piece):
+    # Convert the shape into relative coordinates
+    shape_pos = convert_shape_format(current_piece)
+    # Sort by height, the tallest piece is at the head
+    height = sorted(shape_pos, key=lambda x: x[1])
+    max_height = height[0]
+    # Return a score based on the height
+    if (20 - max_height[1]) < 10:
+        return (20 - max_height[1]) * -10
+    else:
+        return (20 - max_height[1]) * -10
+
+
+# Heuristic helper function to calculate the gaps created by this move
+def heur_gaps(current_piece, board):
+    gap = 0
+    rotation = current_piece.compiled()
+    shape_pos = None
+    # Go through all columns of the tetronimo
+    for c in range(rotation.width):
+        j = current_piece.x + rotation.left + c
+        i = current_piece.y + rotation.tops[c]
+        # Columns starting above or outside the grid have no gaps
+        if i < 0 or not 0 <= j < board_width:
+            continue
+        # When the piece is above the column top, everything down to the top is a gap
+        surface = board_height - board.heights[j]
+        bottom = current_piece.y + rotation.bottoms[c]
+        if bottom < surface:
+            gap += surface - bottom - 1
+        else:
+            # The piece is under an overhang, walk down the column
+            if shape_pos is None:
+                shape_pos = convert_shape_format(current_piece)
+            y = i
+            while (y < 20):
+                # IF this space is empty and not a part of the piece, its a gap
+                if board.empty(j, y) and (j, y) not in shape_pos:
+                    gap += 1
+                if not board.empty(j, y):
+                    break
+                y += 1
+    return gap * -50
+
+
+# Heuristic helper function to calculate amount of full lines made
+def heur_rows(current_piece, board):
+    rotation = current_piece.compiled()
+    row_fill = board.row_fill
+    # Rows that are already full, then every row the piece completes, the board is never modified
+    inc = row_fill.count(board_width)
+    for dy, count in rotation.row_counts:
+        y = current_piece.y + dy
+        if 0 <= y < board_height and row_fill[y] + count == board_width:
+            inc += 1
+    return inc * 190
+
+
+# Heuristic helper function to calculate amount of bumps made by the piece
+def heur_bump(current_piece, board):
+    # Convert the shape into relative coordinates
+    shape_pos = convert_shape_format(current_piece)
+    shape_pos = sorted(shape_pos, key=lambda x: x[1])
+    x_list = []
+    bump = 0
+    # If the piece creates makes the grid have a >2 high difference between columns, that is a bump
+    # If the piece is by the wall, that is also negative
+    for (j, i) in shape_pos:
+        if not(j in x_list):
+            x_list.append(j)
+            if board.empty(j-1, i-1) and board.empty(j-1, i):
+                if (j-1, i) not in shape_pos and (j-1, i-1) not in shape_pos:
+                    bump += 2
+            if board.empty(j+1, i-1) and board.empty(j+1, i):
+                if (j+1, i) not in shape_pos and (j+1, i-1) in shape_pos:
+                    bump += 2
+            if (j+1 == 10):
+                bump += 1
+            if (j-1 == 0):
+                bump += 1
+    return bump * -20
+
+
+# Value of a placement for the piece being played now
+def depth1_value(piece, board):
+    w = weights
+    return -1 * (w['bump'] * heur_bump(piece,board) + w['height'] * heur_height(piece) + w['rows'] * heur_rows(piece, board) + w['gaps'] * heur_gaps(piece, board))
+
+
+# Value of a placement for the pieces after it
+def depth2_value(piece, board):
+    w = weights
+    return -1 * (w['next_bump'] * heur_bump(piece,board) + heur_height(piece) * w['next_height'] +  w['next_gaps'] * heur_gaps(piece, board))
+
+
+# Single piece move generator shared by every search
+# Returns (x, y, rotation, value) for every placement found, in the order they are found
+def enumerate_placements(piece, board, scorer):
+    placements = []
+    # Move the piece to a valid location
+    piece.y = 4
+    piece.rotation = 0
+    num_of_rotation = len(piece.shape)
+    # Check every rotation
+    while (num_of_rotation >= 0):
+        # goes all the way to the left
+        while (valid_space(piece, board)):
+            piece.x -= 1
+        piece.x += 1
+        # goes one block at a time to the right
+        while (valid_space(piece, board)):
+            # drops piece to the bottom
+            drop_piece(piece, board)
+            # Heuristics
+            placements.append((piece.x, piece.y, piece.rotation, scorer(piece, board)))
+            # Reset the height and move the piece over to the right
+            piece.y = 4
+            piece.x += 1
+        # Reset X and Y values and rotate the piece
+        num_of_rotation -= 1
+        piece.y = 4
+        piece.x = 4
+        piece.rotation += 1
+        if not(valid_space(piece, board)):
+            piece.rotation -= 1
+    return placements
+
+
+# Calculate best move for current piece
+# Returns the moves sorted by value, only the best k of them if k is given
+def depth1_ai(current_piece, next_piece, board, locked_positions, k=None):
+    placements = enumerate_placements(current_piece, board, depth1_value)
+    best = select_top(((value, x, y, rotation) for x, y, rotation, value in placements), k)
+    return [Move(x, y, current_piece.shape, rotation, value, current_piece.index)
+            for value, x, y, rotation in best]
+
+
+# Calculate best move for current piece from the placements it can really be moved into
+# Every distinct placement is scored once, and tucks under overhangs are found as well
+# Returns the moves sorted by value, only the best k of them if k is given
+def depth1_reachable_ai(current_piece, next_piece, board, locked_positions, cache=None, k=None):
+    # (value, x, y, rotation, path) for every placement, generated one at a time
+    def candidates():
+        for x, y, rotation, path in reachable_placements(current_piece, board, cache):
+            current_piece.x = x
+            current_piece.y = y
+            current_piece.rotation = rotation
+            yield (depth1_value(current_piece, board), x, y, rotation, path)
+
+    return [Move(x, y, current_piece.shape, rotation, value, current_piece.index, path)
+            for value, x, y, rotation, path in select_top(candidates(), k)]
+
+
+# Values of every placement of the next piece on a board, in the order they are generated
+# Only depends on the board and the piece so the result can be cached by hash
+def depth2_values(next_piece, board):
+    next_piece.x = 4
+    return tuple(value for x, y, rotation, value in enumerate_placements(next_piece, board, depth2_value))
+
+
+# Calculate best move for current piece while considering the next piece
+# If a cache is given, boards that were already evaluated for the next piece are not evaluated again
+# Returns the moves sorted by value, only the best k of them if k is given
+def depth2_ai(moves, current_piece, next_piece, board, locked_positions, cache=None, k=None):
+    current_piece.x = 0
+    current_piece.y = 0
+
+    # (value, first move) for every placement of the next piece, generated one at a time
+    def candidates():
+        # Generate next best moves for the top 10 moves for the first piece
+        for move in moves[:10]:
+            current_piece.rotation = move.rotation
+            current_piece.x = move.x
+            current_piece.y = move.y
+            # Play the move on the board itself and take it back once the next piece is evaluated,
+            # no board is copied and the board is left the way it was
+            placement = board.place(current_piece)
+            try:
+                values = None
+                if cache is not None:
+                    key = board.piece_hash(next_piece.index)
+                    values = cache.get(key)
+                if values is None:
+                    values = depth2_values(next_piece, board)
+                    if cache is not None:
+                        cache.put(key, values)
+            finally:
+                board.undo(placement)
+            move_value = weights['move'] * move.value
+            for next_value in values:
+                yield (weights['next'] * next_value + move_value, move)
+
+    return [Move(move.x, move.y, move.shape, move.rotation, value, move.index)
+            for value, move in select_top(candidates(), k)]
+
+
+# Policy for Game.run_ai that plays the best depth 1 move
+def depth1_policy(game):
+    moves = depth1_ai(game.current_piece, game.next_piece, game.board, game.board.colors, k=1)
+    if len(moves) == 0:
+        return None
+    return moves[0]
+
+
+# Policy for Game.run_ai that plays the best depth 2 move
+def depth2_policy(game):
+    # depth2_ai only expands the best 10 moves, so only those are kept
+    moves = depth1_ai(game.current_piece, game.next_piece, game.board, game.board.colors, k=10)
+    if len(moves) == 0:
+        return None
+    depth_moves = depth2_ai(moves, game.current_piece, game.next_piece, game.board, game.board.colors,
+                            game.cache, k=1)
+    if len(depth_moves) == 0:
+        return None
+    return depth_moves[0]
+
+
+# Policy for Game.run_ai that plays the best reachable depth 1 move
+def depth1_reachable_policy(game):
+    moves = depth1_reachable_ai(game.current_piece, game.next_piece, game.board, game.board.colors,
+                                game.cache, k=1)
+    if len(moves) == 0:
+        return None
+    return moves[0]
@@ -0,0 +1,158 @@
+import random
+import sys
+import time
+import numpy as np
+from board import board_height, board_width
+from game import shape_table
+
+# Many games played in lockstep
+# All boards live in one (N, 20, 10) boolean array and every step drops, locks, clears and
+# scores a piece on every board at once. The rules are the ones of Game: pieces fall straight
+# down from above the stack, every cleared row is worth 10 points and a game is lost once a block
+# ends up above row 1. Every board draws its pieces from its own seeded generator the same way
+# Game does, so board i plays the same pieces as Game(seed=seeds[i]).
+
+# Every shape gets 4 rotations, shapes with fewer repeat theirs like Piece.compiled does
+max_rotations = 4
+
+# Block offsets of every (shape, rotation), shape (7, 4, 4)
+cell_dx = np.array([[[dx for dx, dy in table[r % len(table)].cells] for r in range(max_rotations)]
+                    for table in shape_table])
+cell_dy = np.array([[[dy for dx, dy in table[r % len(table)].cells] for r in range(max_rotations)]
+                    for table in shape_table])
+# Columns a piece may be placed at for every (shape, rotation): from -left to board_width - 1 - right
+min_x = -cell_dx.min(axis=2)
+max_x = board_width - 1 - cell_dx.max(axis=2)
+
+
+class BatchEnv(object):
+    def __init__(self, n):
+        self.n = n
+        self.boards = np.zeros((n, board_height, board_width), dtype=bool)
+        self.current = np.zeros(n, dtype=np.int64)
+        self.next = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.lines = np.zeros(n, dtype=np.int64)
+        self.pieces = np.zeros(n, dtype=np.int64)
+        self.over = np.zeros(n, dtype=bool)
+        self.randoms = []
+
+    # Start a new game on every board, one seed per board
+    def reset(self, seeds):
+        if len(seeds) != self.n:
+            raise ValueError('expected %d seeds, got %d' % (self.n, len(seeds)))
+        self.randoms = [None] * self.n
+        self.restart(range(self.n), seeds)
+        return self.observation()
+
+    # Start new games on some of the boards, e.g. the ones whose game is over
+    def restart(self, indices, seeds):
+        for i, seed in zip(indices, seeds):
+            self.boards[i] = False
+            self.score[i] = 0
+            self.lines[i] = 0
+            self.pieces[i] = 0
+            self.over[i] = False
+            rng = self.randoms[i] = random.Random(seed)
+            # Drawn in the same order as Game: the current piece, then the preview
+            self.current[i] = rng.randrange(len(shape_table))
+            self.next[i] = rng.randrange(len(shape_table))
+
+    def observation(self):
+        return {'boards': self.boards, 'current': self.current, 'next': self.next,
+                'score': self.score, 'lines': self.lines, 'over': self.over}
+
+    # Row of the highest block in every column, board_height for empty columns, shape (N, 10)
+    def surfaces(self):
+        return np.where(self.boards.any(axis=1), self.boards.argmax(axis=1), board_height)
+
+    # Drop the current piece of every board at (rotation, x), actions has shape (N, 2)
+    # Boards whose game is over are left alone. A piece that does not fit between the walls
+    # raises ValueError, the same as Game.step for an invalid placement.
+    # Returns the observation and the points scored by every board
+    def step(self, actions):
+        actions = np.asarray(actions)
+        active = np.flatnonzero(~self.over)
+        reward = np.zeros(self.n, dtype=np.int64)
+        if len(active) == 0:
+            return self.observation(), reward
+        shape = self.current[active]
+        rotation = actions[active, 0] % max_rotations
+        x = actions[active, 1]
+        bad = (x < min_x[shape, rotation]) | (x > max_x[shape, rotation])
+        if bad.any():
+            raise ValueError('invalid placement on boards %s' % active[bad].tolist())
+
+        # Landing row: the lowest y where every block is still above its column's surface
+        cols = x[:, None] + cell_dx[shape, rotation]
+        dys = cell_dy[shape, rotation]
+        surface = self.surfaces()[active[:, None], cols]
+        y = (surface - 1 - dys).min(axis=1)
+        rows = y[:, None] + dys
+
+        # Lock the blocks that are on the grid, the ones above it only count for losing
+        on_grid = rows >= 0
+        owner = np.broadcast_to(active[:, None], rows.shape)
+        self.boards[owner[on_grid], rows[on_grid], cols[on_grid]] = True
+
+        # Clear full rows: a stable sort on "not full" moves the full rows to the top of the board
+        # with the other rows below them in their old order, then the moved rows are emptied
+        boards = self.boards[active]
+        full = boards.all(axis=2)
+        cleared = full.sum(axis=1)
+        clearing = np.flatnonzero(cleared)
+        if len(clearing):
+            order = np.argsort(~full[clearing], axis=1, kind='stable')
+            compacted = np.take_along_axis(boards[clearing], order[:, :, None], axis=1)
+            compacted[np.arange(board_height)[None, :] < cleared[clearing, None]] = False
+            boards[clearing] = compacted
+            self.boards[active] = boards
+
+        self.lines[active] += cleared
+        reward[active] = cleared * 10
+        self.score += reward
+        self.pieces[active] += 1
+
+        # check_lost: a block in row 0, or a block above the grid that the cleared rows did not
+        # move down to row 1 or below
+        above = (~on_grid & (rows + cleared[:, None] < 1)).any(axis=1)
+        self.over[active] = boards[:, 0, :].any(axis=1) | above
+
+        # Spawn the next piece on every board that played
+        self.current[active] = self.next[active]
+        self.next[active] = [self.randoms[i].randrange(len(shape_table)) for i in active]
+        return self.observation(), reward
+
+    # A random valid (rotation, x) for the current piece of every board
+    def random_actions(self, rng):
+        rotation = rng.integers(0, max_rotations, self.n)
+        low = min_x[self.current, rotation]
+        high = max_x[self.current, rotation]
+        x = low + (rng.random(self.n) * (high - low + 1)).astype(np.int64)
+        return np.stack([rotation, x], axis=1)
+
+
+# Pieces per second over the whole batch with random placements
+# Games that end are started again so every step plays n pieces
+def measure_throughput(n=256, steps=200, seed=0):
+    env = BatchEnv(n)
+    env.reset([seed + i for i in range(n)])
+    rng = np.random.default_rng(seed)
+    played = 0
+    restarts = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        env.step(env.random_actions(rng))
+        played += n
+        done = np.flatnonzero(env.over)
+        if len(done):
+            env.restart(done, [seed + n + restarts + k for k in range(len(done))])
+            restarts += len(done)
+    elapsed = time.perf_counter() - start
+    return {'boards': n, 'steps': steps, 'pieces': played, 'restarts': restarts,
+            'pieces_per_s': played / elapsed}
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    print(measure_throughput(n))
@@ -0,0 +1,246 @@
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import ai
+import search
+from ai import depth1_ai, depth1_policy, depth1_value, depth2_policy, enumerate_placements
+from game import Game, Piece, clear_rows, convert_shape_format, create_grid, shapes, valid_space
+
+# Reproducible benchmarks for the hot functions and every AI
+# Pieces come from seeded games and the boards from seeded self-play, so two runs on
+# the same commit replay exactly the same work. Results are printed as JSON.
+
+
+# AIs that can be benchmarked, as policies for Game.run_ai
+def ai_policies(seed):
+    policies = {
+        'depth1': depth1_policy,
+        'depth1_reachable': ai.depth1_reachable_policy,
+        'depth2': depth2_policy,
+        'beam3': search.beam_policy(3, 10, rng=random.Random(seed)),
+        'expectimax3': search.expectimax_policy(3, 4),
+    }
+    try:
+        import vector_ai
+        policies['depth1_vectorized'] = vector_ai.depth1_vectorized_policy
+    except ImportError:
+        pass
+    return policies
+
+
+# Value at the given percentile of a list of numbers, nearest rank
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+# Play a seeded depth 1 game and keep the board, piece and chosen move before every lock
+def sample_positions(seed, count):
+    game = Game(seed=seed)
+    positions = []
+    while len(positions) < count and not game.over:
+        moves = depth1_ai(game.current_piece, game.next_piece, game.board, game.board.colors)
+        if len(moves) == 0:
+            break
+        move = moves[0]
+        positions.append((game.board.copy(), game.current_piece.index, move.x, move.y, move.rotation))
+        game.step(move)
+    return positions
+
+
+# Calls per second of a function over a list of argument tuples, repeated until min_time has passed
+def rate(function, arguments, min_time):
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for args in arguments:
+            function(*args)
+        calls += len(arguments)
+        elapsed = time.perf_counter() - start
+    return calls / elapsed
+
+
+# Throughput of the functions the AI and the game loop call the most
+def bench_hot_paths(positions, min_time):
+    pieces = []
+    for board, index, x, y, rotation in positions:
+        piece = Piece(x, y, shapes[index], index)
+        piece.rotation = rotation
+        pieces.append((piece, board))
+    results = {
+        'valid_space_per_s': rate(valid_space, pieces, min_time),
+        'convert_shape_format_per_s': rate(convert_shape_format, [(p,) for p, b in pieces], min_time),
+        'create_grid_per_s': rate(create_grid, [(b.colors,) for p, b in pieces], min_time),
+    }
+
+    # clear_rows changes the board, so every call gets a fresh copy with the move locked in
+    locked = []
+    for piece, board in pieces:
+        after = board.copy()
+        after.lock(convert_shape_format(piece), piece.color)
+        locked.append(after)
+    calls = 0
+    elapsed = 0.0
+    while elapsed < min_time:
+        copies = [board.copy() for board in locked]
+        start = time.perf_counter()
+        for board in copies:
+            clear_rows(board)
+        elapsed += time.perf_counter() - start
+        calls += len(copies)
+    results['clear_rows_per_s'] = calls / elapsed
+
+    # Placements generated and scored by the depth 1 move generator
+    placements = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for piece, board in pieces:
+            piece.x = 5
+            placements += len(enumerate_placements(piece, board, depth1_value))
+        elapsed = time.perf_counter() - start
+    results['placements_per_s'] = placements / elapsed
+    return results
+
+
+# Play seeded games with one AI and time every decision
+# Evaluations are counted through heur_height, which every scalar scorer calls once per placement,
+# and through the vectorized evaluator, which scores a whole array of placements per call
+def bench_policy(policy, seeds, max_pieces):
+    counter = [0]
+    heur_height = ai.heur_height
+
+    def counted(piece):
+        counter[0] += 1
+        return heur_height(piece)
+
+    vector_ai = sys.modules.get('vector_ai')
+    if vector_ai is not None:
+        evaluate_placements = vector_ai.evaluate_placements
+
+        def counted_batch(board, index):
+            scores = evaluate_placements(board, index)
+            counter[0] += len(scores['value'])
+            return scores
+
+    latencies = []
+    pieces = lines = score = 0
+    ai.heur_height = counted
+    if vector_ai is not None:
+        vector_ai.evaluate_placements = counted_batch
+    try:
+        start = time.perf_counter()
+        for seed in seeds:
+            game = Game(seed=seed)
+
+            def timed(game):
+                begin = time.perf_counter()
+                move = policy(game)
+                latencies.append(time.perf_counter() - begin)
+                return move
+            pieces += game.run_ai(timed, max_pieces)
+            lines += game.lines
+            score += game.score
+        total = time.perf_counter() - start
+    finally:
+        ai.heur_height = heur_height
+        if vector_ai is not None:
+            vector_ai.evaluate_placements = evaluate_placements
+    thinking = sum(latencies)
+    results = {
+        'games': len(seeds),
+        'pieces': pieces,
+        'lines': lines,
+        'score': score,
+        'games_per_s': len(seeds) / total,
+        'pieces_per_s': pieces / total,
+        'decisions_per_s': len(latencies) / thinking if thinking else 0.0,
+        'latency_p50_ms': percentile(latencies, 50) * 1000,
+        'latency_p99_ms': percentile(latencies, 99) * 1000,
+    }
+    # A policy that scores its placements some other way is not counted, rather than reported as 0
+    if counter[0]:
+        results['evaluations'] = counter[0]
+        results['evaluations_per_s'] = counter[0] / thinking if thinking else 0.0
+    return results
+
+
+# Commit the benchmark ran on, if this is a git checkout
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(seed=0, games=3, max_pieces=200, positions=100, min_time=0.5, ais=None):
+    policies = ai_policies(seed)
+    names = ais or list(policies)
+    results = {
+        'meta': {'commit': current_commit(), 'python': platform.python_version(), 'seed': seed,
+                 'games': games, 'max_pieces': max_pieces, 'positions': positions},
+        'hot_paths': bench_hot_paths(sample_positions(seed, positions), min_time),
+        'ai': {},
+    }
+    seeds = [seed + i for i in range(games)]
+    for name in names:
+        results['ai'][name] = bench_policy(policies[name], seeds, max_pieces)
+    return results
+
+
+# True for results that are rates or latencies, the ones worth comparing between commits
+def is_timing(key):
+    return key.endswith('_per_s') or key.endswith('_ms')
+
+
+# Ratio of every timing result to a previous run
+# Above 1 is faster for rates, below 1 is faster for latencies
+def compare(current, baseline):
+    ratios = {}
+    for section in ('hot_paths', 'ai'):
+        old_section = baseline.get(section, {})
+        for name, value in current.get(section, {}).items():
+            old = old_section.get(name)
+            if isinstance(value, dict) and isinstance(old, dict):
+                for key, number in value.items():
+                    if is_timing(key) and old.get(key):
+                        ratios['%s.%s.%s' % (section, name, key)] = number / old[key]
+            elif is_timing(name) and old:
+                ratios['%s.%s' % (section, name)] = value / old
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reproducible Tetris AI benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--games', type=int, default=3, help='seeded games per AI')
+    parser.add_argument('--max-pieces', type=int, default=200, help='pieces per game at most')
+    parser.add_argument('--positions', type=int, default=100, help='boards for the hot path benchmarks')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds per hot path benchmark')
+    parser.add_argument('--ai', action='append', help='AI to run, can be repeated (default: all)')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='previous results to compare against')
+    args = parser.parse_args(argv)
+
+    results = run(args.seed, args.games, args.max_pieces, args.positions, args.min_time, args.ai)
+    if args.compare:
+        with open(args.compare) as f:
+            results['compare'] = compare(results, json.load(f))
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
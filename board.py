@@ -0,0 +1,253 @@
+import random
+
+# Board dimensions
+board_width = 10
+board_height = 20
+
+# Bitmask of a row with every column occupied
+full_row = (1 << board_width) - 1
+
+# Zobrist keys, one random 64 bit number per cell and one per piece
+# The seed is fixed so every process hashes the same board to the same value
+zobrist_random = random.Random(4701)
+zobrist_cells = [[zobrist_random.getrandbits(64) for _ in range(board_width)] for _ in range(board_height)]
+zobrist_pieces = [zobrist_random.getrandbits(64) for _ in range(7)]
+
+
+# What Board.undo needs to take back a placement made with Board.place
+#   added     cells the piece set on the grid
+#   replaced  (position, color it had or None) for every block of the piece
+#   heights   (column, height) before the piece, for the columns it added blocks to
+#   features  blocks, holes, bumpiness and hash before the piece
+#   saved     None, or the rows, row fill, columns, heights and colors as they were before clear_rows
+#   cleared   amount of rows the placement cleared
+class Placement(object):
+    __slots__ = ('added', 'replaced', 'heights', 'features', 'saved', 'cleared')
+
+
+# Compact board representation
+# Every row is a single integer where bit x is set if column x is occupied
+# Colors are kept separately (same layout as locked_positions) and are only used for drawing
+# Features the heuristics need are kept up to date on every lock and clear instead of rescanning:
+#   heights   - height of every column, counted from the bottom
+#   row_fill  - amount of blocks in every row
+#   holes     - empty cells below the top of their column
+#   bumpiness - sum of the height differences between neighbouring columns
+#   hash      - Zobrist hash of the occupied cells
+class Board(object):
+    def __init__(self, locked_pos=None):
+        self.rows = [0] * board_height
+        self.colors = {}
+        # Every column as a bitmask where bit k is set if the cell k rows above the bottom is occupied
+        self.cols = [0] * board_width
+        self.heights = [0] * board_width
+        self.row_fill = [0] * board_height
+        self.blocks = 0
+        self.holes = 0
+        self.bumpiness = 0
+        self.hash = 0
+        if locked_pos:
+            for pos, color in locked_pos.items():
+                self.lock([pos], color)
+
+    # Cheap snapshot of the board, only flat lists and the color map are copied
+    # Searches that never draw the board can leave the color map out
+    def copy(self, colors=True):
+        board = Board()
+        board.rows = self.rows[:]
+        if colors:
+            board.colors = self.colors.copy()
+        board.cols = self.cols[:]
+        board.heights = self.heights[:]
+        board.row_fill = self.row_fill[:]
+        board.blocks = self.blocks
+        board.holes = self.holes
+        board.bumpiness = self.bumpiness
+        board.hash = self.hash
+        return board
+
+    # True if the cell is on the grid and not occupied
+    def empty(self, x, y):
+        if 0 <= x < board_width and 0 <= y < board_height:
+            return not (self.rows[y] >> x) & 1
+        return False
+
+    # True if the cell is on the grid and occupied
+    def occupied(self, x, y):
+        if 0 <= x < board_width and 0 <= y < board_height:
+            return bool((self.rows[y] >> x) & 1)
+        return False
+
+    # Determine whether a list of coordinates can be placed on the board
+    # Blocks above the grid (y < 0) are always accepted, the same as valid_space
+    def fits(self, positions):
+        rows = self.rows
+        for x, y in positions:
+            if y > -1:
+                if x < 0 or x >= board_width or y >= board_height:
+                    return False
+                if (rows[y] >> x) & 1:
+                    return False
+        return True
+
+    # Same test as fits using the row bitmasks of a compiled piece rotation
+    # The masks are shifted so bit 0 lands on column shift
+    def fits_masks(self, row_masks, shift, y):
+        rows = self.rows
+        for dy, mask in row_masks:
+            row = y + dy
+            if row > -1:
+                if row >= board_height:
+                    return False
+                if shift >= 0:
+                    mask = mask << shift
+                elif mask & ((1 << -shift) - 1):
+                    return False
+                else:
+                    mask = mask >> -shift
+                if mask > full_row or rows[row] & mask:
+                    return False
+        return True
+
+    # Lock the blocks into the board
+    # Blocks above the grid are only kept in the color map so check_lost can see them
+    # The features are updated in O(blocks locked)
+    def lock(self, positions, color):
+        rows = self.rows
+        cols = self.cols
+        heights = self.heights
+        changed = []
+        for x, y in positions:
+            self.colors[(x, y)] = color
+            if 0 <= x < board_width and 0 <= y < board_height and not (rows[y] >> x) & 1:
+                rows[y] |= 1 << x
+                cols[x] |= 1 << (board_height - 1 - y)
+                self.hash ^= zobrist_cells[y][x]
+                self.row_fill[y] += 1
+                self.blocks += 1
+                # A new block is a hole filled in, or a new top that gets counted back below
+                self.holes -= 1
+                if board_height - y > heights[x] and x not in changed:
+                    changed.append(x)
+        if changed:
+            # Only the bumpiness terms next to a changed column need to be redone
+            self.bumpiness -= self.local_bumpiness(changed)
+            for x in changed:
+                height = cols[x].bit_length()
+                self.holes += height - heights[x]
+                heights[x] = height
+            self.bumpiness += self.local_bumpiness(changed)
+
+    # Lock a piece (anything with x, y and compiled()) and clear the rows it completes
+    # Returns a Placement that undo takes back, so a search can try a move on the board itself
+    # instead of on a copy. Placements have to be undone in the reverse order they were made.
+    # Costs O(blocks of the piece), rows that are cleared add the cost of clear_rows
+    def place(self, piece, color=(0, 0, 1)):
+        rows = self.rows
+        heights = self.heights
+        colors = self.colors
+        positions = [(piece.x + dx, piece.y + dy) for dx, dy in piece.compiled().cells]
+        placement = Placement()
+        placement.replaced = [(pos, colors.get(pos)) for pos in positions]
+        placement.added = [(x, y) for x, y in positions
+                           if 0 <= x < board_width and 0 <= y < board_height and not (rows[y] >> x) & 1]
+        placement.heights = [(x, heights[x]) for x in set(x for x, y in placement.added)]
+        placement.features = (self.blocks, self.holes, self.bumpiness, self.hash)
+        self.lock(positions, color)
+        placement.saved = None
+        placement.cleared = 0
+        if any(rows[y] == full_row for x, y in placement.added):
+            # clear_rows builds new rows, row fill and colors, the old ones are kept as they are.
+            # Columns and heights are changed in place, only those have to be copied
+            placement.saved = (rows, self.row_fill, self.cols[:], heights[:], colors)
+            placement.cleared = self.clear_rows()
+        return placement
+
+    # Take back the last placement made with place
+    def undo(self, placement):
+        if placement.saved is not None:
+            self.rows, self.row_fill, cols, heights, self.colors = placement.saved
+            self.cols[:] = cols
+            self.heights[:] = heights
+        rows = self.rows
+        cols = self.cols
+        row_fill = self.row_fill
+        for x, y in placement.added:
+            rows[y] &= ~(1 << x)
+            cols[x] &= ~(1 << (board_height - 1 - y))
+            row_fill[y] -= 1
+        heights = self.heights
+        for x, height in placement.heights:
+            heights[x] = height
+        colors = self.colors
+        for pos, color in placement.replaced:
+            if color is None:
+                del colors[pos]
+            else:
+                colors[pos] = color
+        self.blocks, self.holes, self.bumpiness, self.hash = placement.features
+
+    # Bumpiness of the neighbour pairs that touch any of the given columns
+    def local_bumpiness(self, columns):
+        heights = self.heights
+        pairs = set()
+        for x in columns:
+            if x > 0:
+                pairs.add(x - 1)
+            if x < board_width - 1:
+                pairs.add(x)
+        return sum(abs(heights[i] - heights[i + 1]) for i in pairs)
+
+    # Zobrist hash of the occupied cells computed from scratch
+    def compute_hash(self):
+        h = 0
+        for y, row in enumerate(self.rows):
+            keys = zobrist_cells[y]
+            while row:
+                low = row & -row
+                h ^= keys[low.bit_length() - 1]
+                row ^= low
+        return h
+
+    # Hash of the board together with the piece that is about to be placed on it
+    def piece_hash(self, index):
+        return self.hash ^ zobrist_pieces[index]
+
+    # Indices of the rows that are completely filled
+    def full_rows(self):
+        return [i for i, row in enumerate(self.rows) if row == full_row]
+
+    # Remove the full rows and move every row above them down
+    # Returns the amount of cleared rows
+    def clear_rows(self):
+        cleared = self.full_rows()
+        if not cleared:
+            return 0
+        self.rows = [0] * len(cleared) + [row for row in self.rows if row != full_row]
+        self.row_fill = [0] * len(cleared) + [n for n in self.row_fill if n != board_width]
+        self.blocks -= board_width * len(cleared)
+        # Take the cleared bits out of every column, top row first so the bit indices stay valid
+        cols = self.cols
+        for x in range(board_width):
+            col = cols[x]
+            for i in cleared:
+                k = board_height - 1 - i
+                col = (col & ((1 << k) - 1)) | ((col >> (k + 1)) << k)
+            cols[x] = col
+            self.heights[x] = col.bit_length()
+        heights = self.heights
+        self.holes = sum(heights) - self.blocks
+        self.bumpiness = sum(abs(heights[i] - heights[i + 1]) for i in range(board_width - 1))
+        self.hash = self.compute_hash()
+        # Every block moves down by the amount of cleared rows below it
+        colors = {}
+        for (x, y), color in self.colors.items():
+            if y in cleared:
+                continue
+            shift = 0
+            for i in cleared:
+                if i > y:
+                    shift += 1
+            colors[(x, y + shift)] = color
+        self.colors = colors
+        return len(cleared)
@@ -0,0 +1,200 @@
+import argparse
+import hashlib
+import json
+import mmap
+import struct
+import sys
+import time
+import ai
+from ai import Move, depth1_policy, depth2_policy
+from game import Game, shapes
+
+# Opening book: decisions of an AI stored by position, so positions it has seen before
+# are answered without searching
+# A position is the surface of the board plus the current and the next piece. Only boards
+# without holes are stored. Full rows are cleared right away, so such a board always has an
+# empty column, and its column heights describe every block exactly. The stored move is then
+# exactly the move the search would find for that position with the same weights.
+#
+# The book is built offline from headless self-play and written as an open addressing hash
+# table, which is memory mapped when it is loaded, so opening even a big book is instant.
+#   header  magic, capacity, entries, policy name, digest of the weights it was built with
+#   slots   key (0 for an empty slot), rotation, x, y
+magic = b'TBK1'
+header = struct.Struct('<4sII16s16s')
+slot = struct.Struct('<QBbbx')
+
+# Highest column a key can hold, 4 bits per column
+max_height = 15
+
+# Multiplier for Fibonacci hashing of the keys
+hash_multiplier = 0x9E3779B97F4A7C15
+hash_mask = (1 << 64) - 1
+
+
+# Key of a position, None if the book can not hold it (holes or a column over max_height)
+# Never 0, that marks an empty slot
+def position_key(board, current, following):
+    if board.holes:
+        return None
+    key = 0
+    for height in board.heights:
+        if height > max_height:
+            return None
+        key = key << 4 | height
+    return ((key << 3 | current) << 3 | following) + 1
+
+
+# Digest of the evaluation weights, a book is only valid for the weights it was built with
+def weights_digest(values=None):
+    return hashlib.md5(json.dumps(values or ai.weights, sort_keys=True).encode()).digest()
+
+
+# Slot a key is looked up from first
+def home_slot(key, bits):
+    return ((key * hash_multiplier) & hash_mask) >> (64 - bits)
+
+
+class Book(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        tag, self.capacity, self.count, policy, self.digest = header.unpack_from(self.data, 0)
+        if tag != magic:
+            raise ValueError('not an opening book')
+        if len(self.data) != header.size + self.capacity * slot.size:
+            raise ValueError('opening book is truncated')
+        self.policy = policy.rstrip(b'\0').decode()
+        self.bits = self.capacity.bit_length() - 1
+        self.hits = 0
+        self.misses = 0
+
+    # True if the book was built by this policy with the weights that are used now
+    def usable(self, policy):
+        return self.policy == policy and self.digest == weights_digest()
+
+    # Stored (rotation, x, y) of a position, or None
+    def lookup(self, board, current, following):
+        key = position_key(board, current, following)
+        if key is not None:
+            data = self.data
+            mask = self.capacity - 1
+            i = home_slot(key, self.bits)
+            while True:
+                stored, rotation, x, y = slot.unpack_from(data, header.size + i * slot.size)
+                if stored == key:
+                    self.hits += 1
+                    return rotation, x, y
+                if stored == 0:
+                    break
+                i = (i + 1) & mask
+        self.misses += 1
+        return None
+
+    def close(self):
+        self.data.close()
+
+
+# Write a book from {key: (rotation, x, y)}, the table is kept at most half full
+def write_book(path, entries, policy):
+    capacity = 1
+    while capacity < 2 * len(entries) or capacity < 2:
+        capacity *= 2
+    bits = capacity.bit_length() - 1
+    table = bytearray(header.size + capacity * slot.size)
+    header.pack_into(table, 0, magic, capacity, len(entries), policy.encode(), weights_digest())
+    mask = capacity - 1
+    for key, (rotation, x, y) in entries.items():
+        i = home_slot(key, bits)
+        while slot.unpack_from(table, header.size + i * slot.size)[0]:
+            i = (i + 1) & mask
+        slot.pack_into(table, header.size + i * slot.size, key, rotation, x, y)
+    with open(path, 'wb') as f:
+        f.write(table)
+
+
+# Policies a book can be built for
+book_policies = {'depth1': depth1_policy, 'depth2': depth2_policy}
+
+
+# Play seeded headless games and keep every decision made on a position the book can hold
+def self_play(policy, seeds, max_pieces, entries=None):
+    entries = {} if entries is None else entries
+    for seed in seeds:
+        game = Game(seed=seed)
+        while not game.over and game.pieces < max_pieces:
+            # The game loop hands every piece to the AI at its spawn column, searches may have moved it
+            game.current_piece.x = 5
+            key = position_key(game.board, game.current_piece.index, game.next_piece.index)
+            move = policy(game)
+            if move is None:
+                break
+            if key is not None:
+                entries[key] = (move.rotation % len(game.current_piece.table), move.x, move.y)
+            game.step(move)
+    return entries
+
+
+# Policy that answers from the book and only searches with the fallback policy on a miss
+# Searches start from the column the piece is in, so only pieces in their spawn column are looked up
+def book_policy(book, fallback):
+    def policy(game):
+        piece = game.current_piece
+        if piece.x == 5:
+            found = book.lookup(game.board, piece.index, game.next_piece.index)
+            if found is not None:
+                rotation, x, y = found
+                return Move(x, y, shapes[piece.index], rotation, None, piece.index)
+        return fallback(game)
+    return policy
+
+
+# Book hits and time per decision on games that were not used to build the book
+def measure(book, name, seeds, max_pieces):
+    results = {}
+    for label, policy in (('search', book_policies[name]),
+                          ('book', book_policy(book, book_policies[name]))):
+        book.hits = book.misses = 0
+        pieces = 0
+        start = time.perf_counter()
+        for seed in seeds:
+            game = Game(seed=seed)
+            while not game.over and game.pieces < max_pieces:
+                game.current_piece.x = 5
+                move = policy(game)
+                if move is None:
+                    break
+                game.step(move)
+            pieces += game.pieces
+        elapsed = time.perf_counter() - start
+        results[label] = {'pieces': pieces, 'ms_per_piece': elapsed * 1000 / pieces,
+                          'hits': book.hits, 'misses': book.misses}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or measure an opening book by self-play')
+    parser.add_argument('--policy', choices=sorted(book_policies), default='depth2')
+    parser.add_argument('--games', type=int, default=200, help='self-play games to build from')
+    parser.add_argument('--max-pieces', type=int, default=60, help='pieces per game at most')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='book.bin')
+    parser.add_argument('--measure', type=int, default=0, metavar='GAMES',
+                        help='play this many other games with and without the book')
+    args = parser.parse_args(argv)
+
+    if args.games:
+        start = time.perf_counter()
+        seeds = [args.seed + i for i in range(args.games)]
+        entries = self_play(book_policies[args.policy], seeds, args.max_pieces)
+        write_book(args.out, entries, args.policy)
+        print('%s: %d positions from %d games in %.1f s' % (args.out, len(entries), args.games,
+                                                            time.perf_counter() - start))
+    if args.measure:
+        book = Book(args.out)
+        seeds = [args.seed + args.games + i for i in range(args.measure)]
+        print(json.dumps(measure(book, args.policy, seeds, args.max_pieces), indent=2))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,352 @@
+import copy
+import random
+from board import Board, board_height
+from cache import LRUCache
+
+# Pieces represented as nested string lists
+# 0's represent an occupied block and is a vacant space
+# Pieces follow tetris naming convention
+# Lists are used to represent the different rotations
+piece_S = [['.....',
+            '.....',
+            '..00.',
+            '.00..',
+            '.....'],
+           ['.....',
+            '..0..',
+            '..00.',
+            '...0.',
+            '.....']]
+
+piece_Z = [['.....',
+            '.....',
+            '.00..',
+            '..00.',
+            '.....'],
+           ['.....',
+            '..0..',
+            '.00..',
+            '.0...',
+            '.....']]
+
+piece_I = [['..0..',
+            '..0..',
+            '..0..',
+            '..0..',
+            '.....'],
+           ['.....',
+            '0000.',
+            '.....',
+            '.....',
+            '.....']]
+
+piece_O = [['.....',
+            '.....',
+            '.00..',
+            '.00..',
+            '.....']]
+
+piece_J = [['.....',
+            '.0...',
+            '.000.',
+            '.....',
+            '.....'],
+           ['.....',
+            '..00.',
+            '..0..',
+            '..0..',
+            '.....'],
+           ['.....',
+            '.....',
+            '.000.',
+            '...0.',
+            '.....'],
+           ['.....',
+            '..0..',
+            '..0..',
+            '.00..',
+            '.....']]
+
+piece_L = [['.....',
+            '...0.',
+            '.000.',
+            '.....',
+            '.....'],
+           ['.....',
+            '..0..',
+            '..0..',
+            '..00.',
+            '.....'],
+           ['.....',
+            '.....',
+            '.000.',
+            '.0...',
+            '.....'],
+           ['.....',
+            '.00..',
+            '..0..',
+            '..0..',
+            '.....']]
+
+piece_T = [['.....',
+            '..0..',
+            '.000.',
+            '.....',
+            '.....'],
+           ['.....',
+            '..0..',
+            '..00.',
+            '..0..',
+            '.....'],
+           ['.....',
+            '.....',
+            '.000.',
+            '..0..',
+            '.....'],
+           ['.....',
+            '..0..',
+            '.00..',
+            '..0..',
+            '.....']]
+
+# Organizes the shapes to match its designated color
+# Shapes 0-6
+shapes = [piece_S, piece_Z, piece_I, piece_O, piece_J, piece_L, piece_T]
+shape_colors = [(7, 225, 27), (255, 50, 19), (10, 233, 245),
+                (255, 213, 0), (9, 68, 230), (255, 151, 28), (204, 37, 207)]
+
+
+# Compiled form of one rotation of a piece, built once from the string templates
+class ShapeRotation(object):
+    def __init__(self, format):
+        # Block offsets from the piece location, already shifted by the -2/-4 offset
+        self.cells = []
+        for i, line in enumerate(format):
+            for j, column in enumerate(line):
+                if column == '0':
+                    self.cells.append((j - 2, i - 4))
+        # Bounding box of the blocks as offsets from the piece location
+        self.left = min(dx for dx, dy in self.cells)
+        self.right = max(dx for dx, dy in self.cells)
+        self.top = min(dy for dx, dy in self.cells)
+        self.bottom = max(dy for dx, dy in self.cells)
+        self.width = self.right - self.left + 1
+        self.height = self.bottom - self.top + 1
+        # Lowest and highest block of every column, counted from the left of the bounding box
+        self.bottoms = [max(dy for dx, dy in self.cells if dx == self.left + c)
+                        for c in range(self.width)]
+        self.tops = [min(dy for dx, dy in self.cells if dx == self.left + c)
+                     for c in range(self.width)]
+        # Bitmask of the blocks in every row, bit 0 is the left of the bounding box
+        self.row_masks = []
+        for dy in range(self.top, self.bottom + 1):
+            mask = 0
+            for cx, cy in self.cells:
+                if cy == dy:
+                    mask |= 1 << (cx - self.left)
+            self.row_masks.append((dy, mask))
+        # Amount of blocks in every row of the piece
+        self.row_counts = [(dy, bin(mask).count('1')) for dy, mask in self.row_masks]
+
+
+# Every rotation of every shape compiled once, indexed the same way as shapes
+shape_table = [[ShapeRotation(format) for format in shape] for shape in shapes]
+
+
+# Piece includes the location (coordinates), shape, color, and rotation
+class Piece(object):
+    def __init__(self, x, y, shape, index=None):
+        self.x = x
+        self.y = y
+        self.shape = shape
+        # The index is passed in on spawn, the lookup is only a fallback
+        if index is None:
+            index = shapes.index(shape)
+        self.index = index
+        self.table = shape_table[index]
+        self.color = shape_colors[index]
+        self.rotation = 0
+
+    # Compiled data for the current rotation
+    def compiled(self):
+        return self.table[self.rotation % len(self.table)]
+
+    # Copy of the piece at the same position and rotation
+    def copy(self):
+        piece = Piece(self.x, self.y, self.shape, self.index)
+        piece.rotation = self.rotation
+        return piece
+
+
+# Initialize the grid
+# Return the updated grid with proper values for the occupancy and colors
+def create_grid(locked_pos={}):
+    grid = [[(0, 0, 0) for _ in range(10)] for _ in range(20)]
+    # Create a row in each of the columns
+
+    # Used to draw the grid, determine the occupancy and color
+    for i in range(len(grid)):
+        for j in range(len(grid[i])):
+            if (j, i) in locked_pos:
+                c = locked_pos[(j, i)]
+                grid[i][j] = c
+    return grid
+
+
+# Manages the rotation of the pieces
+def convert_shape_format(shape):
+    x = shape.x
+    y = shape.y
+    # Offsets come from the compiled table so no strings are parsed here
+    return [(x + dx, y + dy) for dx, dy in shape.compiled().cells]
+
+
+# Determine whether a space is already occupied, disables invalid moves
+    # and detects collisions
+def valid_space(shape, board):
+    # If the piece is in an occupied space or not on the grid, it is not a valid move
+    rotation = shape.compiled()
+    return board.fits_masks(rotation.row_masks, shape.x + rotation.left, shape.y)
+
+
+# Drop a piece straight down until it rests on the board
+def drop_piece(shape, board):
+    rotation = shape.compiled()
+    col = shape.x + rotation.left
+    heights = board.heights
+    # When the piece is above the top of every column it covers, the landing row comes from the heights
+    land = None
+    for c in range(rotation.width):
+        surface = board_height - heights[col + c]
+        if shape.y + rotation.bottoms[c] >= surface:
+            break
+        y = surface - 1 - rotation.bottoms[c]
+        if land is None or y < land:
+            land = y
+    else:
+        shape.y = land
+        return
+    # Otherwise the piece is tucked under an overhang, step down one row at a time
+    while (valid_space(shape, board)):
+        shape.y += 1
+    shape.y -= 1
+
+
+# Check if the gamestate is in a lost position
+def check_lost(positions):
+    # If the pieces go beyond the grid height, the game is lost
+    for pos in positions:
+        x, y = pos
+        if y < 1:
+            return True
+    return False
+
+
+# Returns a random piece
+# Pass a seeded random.Random to get a fixed piece sequence
+def get_shape(rng=random):
+    index = rng.randrange(len(shapes))
+    return Piece(5, 0, shapes[index], index)
+
+
+# If a row is full, this removes the blocks and moves the above values down
+def clear_rows(board):
+    # A row is full when its bitmask has every column set
+    return board.clear_rows()
+
+
+
+# Amount of evaluated boards the AI keeps per game
+eval_cache_size = 4096
+
+
+# Headless game state: the board, the piece queue, the score and the line clears
+# Nothing in here touches pygame, the window in tetris.py drives one of these
+# The cache keeps AI board evaluations for the whole game
+# With a seed the game has its own random generator, so the piece sequence can be replayed
+class Game(object):
+    def __init__(self, preview=1, seed=None):
+        self.seed = seed
+        self.random = random if seed is None else random.Random(seed)
+        self.board = Board()
+        self.current_piece = get_shape(self.random)
+        # Upcoming pieces, the head of the queue is the next piece
+        self.queue = [get_shape(self.random) for _ in range(preview)]
+        self.score = 0
+        self.lines = 0
+        self.pieces = 0
+        self.over = False
+        self.cache = LRUCache(eval_cache_size)
+        # Every locked piece as (piece index, rotation, x, y), enough to replay the game from its seed
+        self.history = []
+
+    @property
+    def next_piece(self):
+        return self.queue[0]
+
+    # Copy of the position for a search that runs next to the game loop
+    # The board, the pieces and the piece generator are copied so the search can play moves freely,
+    # the evaluation cache is shared since only one search uses it at a time
+    def snapshot(self):
+        game = copy.copy(self)
+        game.board = self.board.copy(colors=False)
+        game.current_piece = self.current_piece.copy()
+        game.queue = [piece.copy() for piece in self.queue]
+        game.random = random.Random()
+        game.random.setstate(self.random.getstate())
+        game.history = list(self.history)
+        return game
+
+    # The game as it will be once a move is played, the real game is not changed
+    # The copied generator draws the same pieces the real game will draw next
+    def predict(self, move):
+        game = self.snapshot()
+        # Queued pieces are back at their spawn position, a search may have moved them around
+        game.queue = [Piece(5, 0, piece.shape, piece.index) for piece in self.queue]
+        game.step(move)
+        return game
+
+    # Everything a policy looks at, games with the same key get the same move
+    def position_key(self):
+        piece = self.current_piece
+        return (tuple(self.board.rows), piece.index, piece.x, piece.y, piece.rotation,
+                tuple(piece.index for piece in self.queue))
+
+    # Lock the current piece where it is, clear full rows and spawn the next piece
+    # Returns the amount of cleared rows
+    def lock_piece(self):
+        piece = self.current_piece
+        self.history.append((piece.index, piece.rotation % len(piece.table), piece.x, piece.y))
+        self.board.lock(convert_shape_format(piece), piece.color)
+        self.current_piece = self.queue.pop(0)
+        self.queue.append(get_shape(self.random))
+        inc = clear_rows(self.board)
+        self.lines += inc
+        self.score += inc * 10
+        self.pieces += 1
+        if check_lost(self.board.colors):
+            self.over = True
+        return inc
+
+    # Play a placement for the current piece, anything with x, y and rotation works (e.g. a Move)
+    def step(self, move):
+        piece = self.current_piece
+        piece.rotation = move.rotation
+        piece.x = move.x
+        piece.y = move.y
+        if not valid_space(piece, self.board):
+            raise ValueError('invalid placement (%d, %d, %d)' % (move.rotation, move.x, move.y))
+        return self.lock_piece()
+
+    # Let a policy play up to n_pieces pieces without a window
+    # The policy is called with the game and returns a move, or None if there is no valid move
+    def run_ai(self, policy, n_pieces):
+        placed = 0
+        while not self.over and placed < n_pieces:
+            move = policy(self)
+            if move is None:
+                self.over = True
+                break
+            self.step(move)
+            placed += 1
+        return placed
@@ -0,0 +1,119 @@
+from collections import deque
+from board import board_height, board_width
+
+# Inputs a path is made of, the same keys the game loop handles
+# The last down of a path moves the piece into the stack, which locks it
+left = 'left'
+right = 'right'
+rotate = 'rotate'
+down = 'down'
+inputs = (left, right, rotate, down)
+
+# Piece locations a search can get to, with room for the -2/-4 cell offsets on every side
+x_offset = 4
+y_offset = 4
+x_range = board_width + 2 * x_offset
+y_range = board_height + 2 * y_offset
+
+
+# Every distinct placement the piece can actually be moved into from where it is now
+# Breadth first search over (x, y, rotation) with the left, right, rotate and down inputs,
+# so placements under overhangs (tucks and spins) are found as well.
+# Placements that cover the same cells are only returned once, with the shortest input path.
+# Returns [(x, y, rotation, path)] in the order they are found
+# Cached per board, piece and start location when a cache is given
+def reachable_placements(piece, board, cache=None):
+    table = piece.table
+    start = (piece.x, piece.y, piece.rotation % len(table))
+    if cache is not None:
+        key = (board.piece_hash(piece.index), start, 'reachable')
+        placements = cache.get(key)
+        if placements is not None:
+            return placements
+
+    fits_masks = board.fits_masks
+    masks = [(rotation.row_masks, rotation.left, rotation.right) for rotation in table]
+
+    # Blocks above the grid are accepted like in valid_space, but the piece has to stay between
+    # the walls, otherwise it could move sideways forever while it is still above the grid
+    def fits(x, y, rotation):
+        row_masks, first, last = masks[rotation]
+        if x + first < 0 or x + last >= board_width:
+            return False
+        return fits_masks(row_masks, x + first, y)
+
+    placements = []
+    if fits(*start):
+        # One flag per state, and the state and input every state was first reached from
+        visited = bytearray(len(table) * y_range * x_range)
+        parents = {}
+        cells_seen = set()
+
+        def state_id(x, y, rotation):
+            return (rotation * y_range + y + y_offset) * x_range + x + x_offset
+
+        seeds = sky_states(start, table, board)
+        for state in seeds:
+            visited[state_id(*state)] = 1
+        frontier = deque(seeds)
+        while frontier:
+            state = frontier.popleft()
+            x, y, rotation = state
+            following = ((x - 1, y, rotation), (x + 1, y, rotation),
+                         (x, y, (rotation + 1) % len(table)), (x, y + 1, rotation))
+            for key_input, (nx, ny, nrotation) in zip(inputs, following):
+                if fits(nx, ny, nrotation):
+                    index = state_id(nx, ny, nrotation)
+                    if not visited[index]:
+                        visited[index] = 1
+                        parents[(nx, ny, nrotation)] = (state, key_input)
+                        frontier.append((nx, ny, nrotation))
+                elif key_input == down:
+                    # The piece can not move down anymore, so it locks here
+                    cells = frozenset((x + dx, y + dy) for dx, dy in table[rotation].cells)
+                    if cells not in cells_seen:
+                        cells_seen.add(cells)
+                        path = input_path(parents, seeds, state) + (down,)
+                        placements.append((x, y, rotation, path))
+    placements = tuple(placements)
+    if cache is not None:
+        cache.put(key, placements)
+    return placements
+
+
+# Where the search starts, as {state: inputs from the start location}
+# Rows above the highest block are empty, so up there only the walls matter and every location
+# between the walls can be reached by rotating and moving sideways before dropping. Instead of
+# searching all of those rows, the search starts from every location at the lowest row where
+# the piece is still completely above the stack.
+def sky_states(start, table, board):
+    x, y, rotation = start
+    sky = board_height - max(board.heights) - 1 - max(r.bottom for r in table)
+    if y >= sky:
+        return {start: ()}
+    # Sideways and rotation moves at the start row, only checked against the walls
+    paths = {(x, rotation): ()}
+    frontier = deque([(x, rotation)])
+    while frontier:
+        state = frontier.popleft()
+        x, rotation = state
+        for key_input, following in ((left, (x - 1, rotation)), (right, (x + 1, rotation)),
+                                     (rotate, (x, (rotation + 1) % len(table)))):
+            nx, nrotation = following
+            if following not in paths and nx + table[nrotation].left >= 0 \
+                    and nx + table[nrotation].right < board_width:
+                paths[following] = paths[state] + (key_input,)
+                frontier.append(following)
+    drop = (down,) * (sky - y)
+    return dict(((x, sky, rotation), path + drop) for (x, rotation), path in paths.items())
+
+
+# Inputs that lead from the start of the search to a state
+def input_path(parents, seeds, state):
+    path = []
+    while state in parents:
+        state, key_input = parents[state]
+        path.append(key_input)
+    path.reverse()
+    return seeds[state] + tuple(path)
+
@@ -0,0 +1,161 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from ai import Move, depth1_ai, depth2_ai, depth2_values, select_top, weights
+from game import Game, Piece, shapes
+
+
+# Process pool for the parallel search, one worker per core by default
+def make_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+
+# Runs in a worker: values of every placement of the next piece after each of a chunk of first moves
+# The board is sent once per chunk, every first move is played on it and taken back
+def depth2_chunk(task):
+    board, index, following, placements = task
+    piece = Piece(4, 4, shapes[index], index)
+    next_piece = Piece(4, 4, shapes[following], following)
+    results = []
+    for x, y, rotation in placements:
+        piece.x = x
+        piece.y = y
+        piece.rotation = rotation
+        placement = board.place(piece)
+        results.append(depth2_values(next_piece, board))
+        board.undo(placement)
+    return results
+
+
+# Same search as depth2_ai, but the first level branches are evaluated in the pool
+# A single branch is only about half a millisecond of work, about what sending it to a process costs,
+# so the branches are split into one chunk per worker and every chunk is one task.
+# Results are merged in branch order, so the returned moves are identical to depth2_ai
+def depth2_ai_parallel(moves, current_piece, next_piece, board, locked_positions, pool, cache=None,
+                       k=None, chunks=None):
+    branches = moves[:10]
+    keys = []
+    values = []
+    missing = []
+    for i, move in enumerate(branches):
+        current_piece.rotation = move.rotation
+        current_piece.x = move.x
+        current_piece.y = move.y
+        # Only the hash of the board after the move is needed here, the workers play the move themselves
+        placement = board.place(current_piece)
+        key = board.piece_hash(next_piece.index)
+        board.undo(placement)
+        keys.append(key)
+        values.append(cache.get(key) if cache is not None else None)
+        if values[i] is None:
+            missing.append(i)
+
+    if missing:
+        # The color map is not needed to evaluate a board, leave it out of the pickle
+        snapshot = board.copy(colors=False)
+        chunks = min(chunks or os.cpu_count() or 1, len(missing))
+        parts = [missing[c::chunks] for c in range(chunks)]
+        futures = [pool.submit(depth2_chunk, (snapshot, current_piece.index, next_piece.index,
+                                              [(branches[i].x, branches[i].y, branches[i].rotation)
+                                               for i in part]))
+                   for part in parts]
+        for part, future in zip(parts, futures):
+            for i, result in zip(part, future.result()):
+                values[i] = result
+                if cache is not None:
+                    cache.put(keys[i], result)
+
+    def candidates():
+        for move, branch_values in zip(branches, values):
+            move_value = weights['move'] * move.value
+            for next_value in branch_values:
+                yield (weights['next'] * next_value + move_value, move)
+
+    # The selection is stable, so ties stay in branch order like the serial search
+    return [Move(move.x, move.y, move.shape, move.rotation, value, move.index)
+            for value, move in select_top(candidates(), k)]
+
+
+# Runs in a worker: the best depth 2 move of one position as (x, y, rotation), None if there is none
+def depth2_decision(task):
+    board, current, following = task
+    current_piece = Piece(5, 0, shapes[current], current)
+    next_piece = Piece(5, 0, shapes[following], following)
+    moves = depth1_ai(current_piece, next_piece, board, board.colors, k=10)
+    if len(moves) == 0:
+        return None
+    best = depth2_ai(moves, current_piece, next_piece, board, board.colors, k=1)[0]
+    return best.x, best.y, best.rotation
+
+
+# Best depth 2 move of many independent positions, e.g. the states of a benchmark or of many games
+# Every task is a whole decision, so there is no serial part left in the parent
+def depth2_batch_parallel(pool, states, workers=None):
+    tasks = [(board.copy(colors=False), current, following) for board, current, following in states]
+    chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+    return list(pool.map(depth2_decision, tasks, chunksize=chunksize))
+
+
+# Policy for Game.run_ai that plays the best depth 2 move found with the pool
+def depth2_parallel_policy(pool, workers=None):
+    def policy(game):
+        moves = depth1_ai(game.current_piece, game.next_piece, game.board, game.board.colors, k=10)
+        if len(moves) == 0:
+            return None
+        depth_moves = depth2_ai_parallel(moves, game.current_piece, game.next_piece, game.board,
+                                         game.board.colors, pool, game.cache, k=1, chunks=workers)
+        if len(depth_moves) == 0:
+            return None
+        return depth_moves[0]
+    return policy
+
+
+# Time the serial and the parallel search on the same decisions and report the speedup
+# The cache is left out so both sides do the same amount of work
+#   speedup        one decision at a time, its branches split over the pool
+#   ceiling        best speedup the first one can reach with this many workers: depth 1, hashing the
+#                  branches and merging run in the parent, only the rest is split (Amdahl's law)
+#   batch_speedup  every decision is a task of its own, which scales with the workers
+def measure_speedup(decisions=100, workers=None, seed=0):
+    game = Game(seed=seed)
+    states = []
+    while len(states) < decisions and not game.over:
+        moves = depth1_ai(game.current_piece, game.next_piece, game.board, game.board.colors)
+        if len(moves) == 0:
+            break
+        states.append((game.board.copy(), game.current_piece.index, game.next_piece.index))
+        game.step(moves[0])
+
+    def run(search):
+        start = time.perf_counter()
+        for board, current, following in states:
+            current_piece = Piece(5, 0, shapes[current], current)
+            next_piece = Piece(5, 0, shapes[following], following)
+            moves = depth1_ai(current_piece, next_piece, board, board.colors)
+            search(moves, current_piece, next_piece, board)
+        return time.perf_counter() - start
+
+    workers = workers or os.cpu_count()
+    serial = run(lambda m, c, n, b: depth2_ai(m, c, n, b, b.colors))
+    # The part of a decision the parent runs alone
+    depth1 = run(lambda m, c, n, b: None)
+    start = time.perf_counter()
+    for state in states:
+        depth2_decision((state[0].copy(colors=False),) + state[1:])
+    batch_serial = time.perf_counter() - start
+    with make_pool(workers) as pool:
+        # Warm up the workers so process start up is not counted
+        list(pool.map(abs, range(workers)))
+        parallel = run(lambda m, c, n, b: depth2_ai_parallel(m, c, n, b, b.colors, pool, chunks=workers))
+        start = time.perf_counter()
+        depth2_batch_parallel(pool, states, workers)
+        batch = time.perf_counter() - start
+    share = depth1 / serial
+    return {'decisions': len(states), 'workers': workers, 'serial_s': serial,
+            'parallel_s': parallel, 'speedup': serial / parallel,
+            'ceiling': 1 / (share + (1 - share) / workers),
+            'batch_serial_s': batch_serial, 'batch_s': batch, 'batch_speedup': batch_serial / batch}
+
+
+if __name__ == '__main__':
+    print(measure_speedup())
@@ -0,0 +1,199 @@
+import json
+import sys
+import threading
+import time
+import ai
+import game
+from board import Board
+
+# Counters and timers for the hot paths of the game loop and the AI
+# Nothing is instrumented until enable() is called: it swaps the functions for timed wrappers
+# in every module that imported them, and disable() puts the originals back, so a game that
+# is not being profiled runs the exact same code as before.
+# Timers are inclusive, a function that calls another timed function counts that time as well.
+
+# Functions that are timed by default, as (module or class, attribute)
+default_targets = [
+    (game, 'valid_space'),
+    (game, 'convert_shape_format'),
+    (game, 'create_grid'),
+    (game, 'clear_rows'),
+    (Board, 'clear_rows'),
+    (ai, 'heur_height'),
+    (ai, 'heur_gaps'),
+    (ai, 'heur_rows'),
+    (ai, 'heur_bump'),
+]
+
+
+# Name of a target in the stats
+def target_name(owner, attribute):
+    if isinstance(owner, type):
+        return owner.__name__ + '.' + attribute
+    return attribute
+
+
+# Calls and time of every timer per frame or per decision, averaged over a list of records
+def breakdown(records):
+    totals = {}
+    for elapsed, counters in records:
+        for name, (calls, seconds) in counters.items():
+            total = totals.setdefault(name, [0, 0.0])
+            total[0] += calls
+            total[1] += seconds
+    n = len(records) or 1
+    return dict((name, {'calls': calls / n, 'ms': seconds * 1000 / n})
+                for name, (calls, seconds) in totals.items())
+
+
+# Collects the timers of every thread separately: the game loop closes a record every frame
+# and AI searches close one every decision. Every period the records are summed up into
+# a summary, which is kept for the HUD and appended to a JSON lines file if a path is given.
+class Profiler(object):
+    def __init__(self, targets=None, decisions=(), path=None, period=1.0):
+        self.targets = list(default_targets if targets is None else targets)
+        # Functions that make one AI decision per call, as (module or class, attribute)
+        self.decision_targets = list(decisions)
+        self.path = path
+        self.period = period
+        self.enabled = False
+        self.patched = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.frames = []
+        self.decisions = []
+        self.period_start = time.perf_counter()
+        self.summary = None
+
+    # Counters of the calling thread since its last record, {name: [calls, seconds]}
+    def counters(self):
+        counters = getattr(self.local, 'counters', None)
+        if counters is None:
+            counters = self.local.counters = {}
+        return counters
+
+    # Counters of the calling thread, which start over afterwards
+    def take(self):
+        counters = self.counters()
+        self.local.counters = {}
+        return counters
+
+    def timed(self, name, function):
+        counters = self.counters
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                entry = counters().get(name)
+                if entry is None:
+                    counters()[name] = [1, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+        return wrapper
+
+    # Every call is one decision, everything timed while it runs is recorded with it
+    def timed_decision(self, function):
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            self.take()
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                with self.lock:
+                    self.decisions.append((elapsed, self.take()))
+        return wrapper
+
+    # Replace a function everywhere it can be looked up from
+    def patch(self, owner, attribute, wrapper):
+        original = getattr(owner, attribute)
+        if isinstance(owner, type):
+            setattr(owner, attribute, wrapper)
+            self.patched.append((owner, attribute, original))
+            return
+        for module in list(sys.modules.values()):
+            # vars() so modules with a lazy __getattr__ are not asked for names they do not have
+            if module is not None and vars(module).get(attribute) is original:
+                setattr(module, attribute, wrapper)
+                self.patched.append((module, attribute, original))
+
+    def enable(self):
+        if self.enabled:
+            return
+        for owner, attribute in self.targets:
+            original = getattr(owner, attribute)
+            self.patch(owner, attribute, self.timed(target_name(owner, attribute), original))
+        for owner, attribute in self.decision_targets:
+            self.patch(owner, attribute, self.timed_decision(getattr(owner, attribute)))
+        self.enabled = True
+        self.frames = []
+        self.decisions = []
+        self.local.counters = {}
+        self.period_start = time.perf_counter()
+
+    def disable(self):
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched = []
+        self.enabled = False
+        self.summary = None
+
+    # Close the record of the current frame, called once per frame by the game loop
+    def end_frame(self, elapsed):
+        self.frames.append((elapsed, self.take()))
+        if time.perf_counter() - self.period_start >= self.period:
+            self.end_period()
+
+    # Sum up the frames and decisions since the last period
+    def end_period(self):
+        now = time.perf_counter()
+        seconds = now - self.period_start
+        with self.lock:
+            decisions = self.decisions
+            self.decisions = []
+        frames = self.frames
+        self.frames = []
+        frame_times = [elapsed for elapsed, counters in frames]
+        decision_times = [elapsed for elapsed, counters in decisions]
+        self.summary = {
+            'time': time.time(),
+            'seconds': seconds,
+            'frames': len(frames),
+            'fps': len(frames) / seconds if seconds else 0.0,
+            'frame_ms': sum(frame_times) * 1000 / len(frames) if frames else 0.0,
+            'frame_ms_max': max(frame_times) * 1000 if frames else 0.0,
+            'per_frame': breakdown(frames),
+            'decisions': len(decisions),
+            'decision_ms': sum(decision_times) * 1000 / len(decisions) if decisions else 0.0,
+            'decision_ms_max': max(decision_times) * 1000 if decisions else 0.0,
+            'per_decision': breakdown(decisions),
+        }
+        self.period_start = now
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(self.summary, sort_keys=True) + '\n')
+        return self.summary
+
+    # Short text version of the last summary, most expensive timers first
+    def hud_lines(self, limit=6):
+        summary = self.summary
+        if summary is None:
+            return ['profiling...']
+        lines = ['%d fps, frame %.2f ms (max %.1f)' % (summary['fps'], summary['frame_ms'],
+                                                       summary['frame_ms_max']),
+                 '%d decisions, %.2f ms (max %.1f)' % (summary['decisions'], summary['decision_ms'],
+                                                       summary['decision_ms_max'])]
+        for title, section in (('per frame', 'per_frame'), ('per decision', 'per_decision')):
+            timers = sorted(summary[section].items(), key=lambda item: -item[1]['ms'])
+            if timers:
+                lines.append(title)
+            for name, stats in timers[:limit]:
+                lines.append('  %s %.0fx %.3f ms' % (name, stats['calls'], stats['ms']))
+        return lines
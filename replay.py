@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import struct
+import sys
+import time
+from board import board_height
+from game import Game
+
+# Binary replay of a seeded game
+#   header     magic, format version, seed, amount of pieces
+#   placements 3 bytes per locked piece: piece index and rotation packed in one byte, then x and y
+#   footer     score, lines, the row bitmasks of the final board and a digest of its locked positions
+# The seed regenerates the piece sequence, the piece index of every placement is only used
+# to check that the replay and the generator still agree.
+magic = b'TTRP'
+version = 1
+header = struct.Struct('<4sBQI')
+placement = struct.Struct('<Bbb')
+footer = struct.Struct('<II%dH16s' % board_height)
+
+
+# Digest of the locked positions, including the blocks above the grid that ended the game
+def positions_digest(positions):
+    return hashlib.md5(repr(sorted(positions.items())).encode()).digest()
+
+
+# A recorded game: its seed, every placement and the result it should end with
+class Replay(object):
+    def __init__(self, seed, placements, score, lines, rows, digest):
+        self.seed = seed
+        # (piece index, rotation, x, y) for every locked piece, in order
+        self.placements = placements
+        self.score = score
+        self.lines = lines
+        self.rows = rows
+        self.digest = digest
+
+
+# Replay of a game that was started with a seed
+def record(game):
+    if game.seed is None:
+        raise ValueError('only games started with a seed can be replayed')
+    return Replay(game.seed, list(game.history), game.score, game.lines, list(game.board.rows),
+                  positions_digest(game.board.colors))
+
+
+def dumps(replay):
+    parts = [header.pack(magic, version, replay.seed, len(replay.placements))]
+    for index, rotation, x, y in replay.placements:
+        parts.append(placement.pack(index | rotation << 3, x, y))
+    parts.append(footer.pack(replay.score, replay.lines, *(replay.rows + [replay.digest])))
+    return b''.join(parts)
+
+
+def loads(data):
+    tag, file_version, seed, count = header.unpack_from(data, 0)
+    if tag != magic:
+        raise ValueError('not a replay file')
+    if file_version != version:
+        raise ValueError('unsupported replay version %d' % file_version)
+    if len(data) != header.size + count * placement.size + footer.size:
+        raise ValueError('replay is truncated or has trailing data')
+    placements = []
+    for packed, x, y in placement.iter_unpack(data[header.size:header.size + count * placement.size]):
+        placements.append((packed & 7, packed >> 3, x, y))
+    values = footer.unpack_from(data, header.size + count * placement.size)
+    return Replay(seed, placements, values[0], values[1], list(values[2:-1]), values[-1])
+
+
+def save(path, replay):
+    with open(path, 'wb') as f:
+        f.write(dumps(replay))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+# Play a replay again without a window, as fast as the engine goes
+# With verify on every placement is checked like Game.step and the result is compared to the
+# recorded one, a mismatch raises ValueError. Returns the game at the end of the replay.
+def play(replay, verify=True):
+    game = Game(seed=replay.seed)
+    for n, (index, rotation, x, y) in enumerate(replay.placements):
+        piece = game.current_piece
+        if piece.index != index:
+            raise ValueError('piece %d is %d, the replay has %d' % (n, piece.index, index))
+        piece.rotation = rotation
+        piece.x = x
+        piece.y = y
+        if verify:
+            game.step(piece)
+        else:
+            game.lock_piece()
+    if verify:
+        if (game.score, game.lines) != (replay.score, replay.lines):
+            raise ValueError('replay ends with score %d and %d lines, %d and %d were recorded'
+                             % (game.score, game.lines, replay.score, replay.lines))
+        if game.board.rows != replay.rows or positions_digest(game.board.colors) != replay.digest:
+            raise ValueError('replay ends on a different board than was recorded')
+    return game
+
+
+# Record a seeded AI game as a replay, to use as a regression or benchmark fixture
+def record_ai(policy, seed, n_pieces):
+    game = Game(seed=seed)
+    game.run_ai(policy, n_pieces)
+    return record(game)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify Tetris replays, or record one from an AI game')
+    parser.add_argument('replays', nargs='*', help='replay files to verify')
+    parser.add_argument('--record', metavar='PATH', help='record a depth 1 game to this file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-pieces', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.record:
+        from ai import depth1_policy
+        replay = record_ai(depth1_policy, args.seed, args.max_pieces)
+        save(args.record, replay)
+        print('%s: %d pieces, score %d' % (args.record, len(replay.placements), replay.score))
+    failed = False
+    for path in args.replays:
+        replay = load(path)
+        start = time.perf_counter()
+        try:
+            play(replay)
+        except ValueError as e:
+            print('%s: FAILED %s' % (path, e))
+            failed = True
+            continue
+        elapsed = time.perf_counter() - start
+        print('%s: ok, %d pieces, score %d, %.0f pieces/s' % (path, len(replay.placements), replay.score,
+                                                               len(replay.placements) / elapsed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import time
+
+# Score store in a SQLite database
+# WAL mode lets many processes write to the same file while others read it, every write is
+# a transaction so a crash never leaves a half written score behind. Scores are buffered and
+# written in batches, and the best score of every mode is read once when the store is opened.
+default_path = 'scores.db'
+
+
+class ScoreStore(object):
+    def __init__(self, path=default_path, batch_size=100, timeout=30.0):
+        self.path = path
+        self.batch_size = batch_size
+        # Other processes may hold the write lock for a moment, wait for it instead of failing
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS scores ('
+                                    'id INTEGER PRIMARY KEY, mode TEXT NOT NULL, score INTEGER NOT NULL, '
+                                    'lines INTEGER NOT NULL, pieces INTEGER NOT NULL, seed INTEGER, '
+                                    'created REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS scores_by_mode ON scores (mode, score DESC)')
+        self.pending = []
+        # Best score of every mode, kept up to date by add
+        self.best = dict(self.connection.execute('SELECT mode, MAX(score) FROM scores GROUP BY mode'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Queue a score, it is written with the next batch
+    def add(self, mode, score, lines=0, pieces=0, seed=None):
+        self.pending.append((mode, score, lines, pieces, seed, time.time()))
+        if score > self.best.get(mode, 0):
+            self.best[mode] = score
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    # Queue the result of a finished game
+    def add_game(self, mode, game):
+        self.add(mode, game.score, game.lines, game.pieces, game.seed)
+
+    # Write every queued score in one transaction
+    def flush(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT INTO scores (mode, score, lines, pieces, seed, created) '
+                                        'VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    # Best score of a mode, or of every mode, as of when the store was opened plus what was added since
+    def high_score(self, mode=None):
+        if mode is not None:
+            return self.best.get(mode, 0)
+        return max(self.best.values()) if self.best else 0
+
+    # Best games of a mode as (score, lines, pieces, seed, created), best first
+    def leaderboard(self, mode, limit=10):
+        self.flush()
+        return self.connection.execute('SELECT score, lines, pieces, seed, created FROM scores '
+                                       'WHERE mode = ? ORDER BY score DESC, created LIMIT ?',
+                                       (mode, limit)).fetchall()
+
+    # Take over the high score of the old scores.txt file, once
+    def import_text(self, path='scores.txt', mode='human'):
+        if self.best or not os.path.exists(path):
+            return
+        with open(path) as f:
+            text = f.read().strip()
+        if text.isdigit():
+            self.add(mode, int(text))
+            self.flush()
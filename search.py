@@ -0,0 +1,244 @@
+import heapq
+import json
+import random
+import time
+from ai import Move, depth1_value, depth2_value, enumerate_placements, weights
+from game import Piece, convert_shape_format, shapes
+
+# Pieces that are not known yet are drawn from here so the game's own sequence is not disturbed
+search_random = random.Random()
+
+
+# Copy of the board after a placement is locked and its full rows are cleared
+# The beam keeps a board per node, depth first searches use Board.place and Board.undo instead
+def play_placement(board, index, x, y, rotation):
+    piece = Piece(x, y, shapes[index], index)
+    piece.rotation = rotation
+    after = board.copy(colors=False)
+    after.lock(convert_shape_format(piece), (0, 0, 1))
+    after.clear_rows()
+    return after
+
+
+# Every placement of a piece on a board, scored like the second level of depth2_ai by default
+# Cached per board, piece and scorer when a cache is given
+def child_placements(board, piece, cache=None, scorer=depth2_value):
+    if cache is not None:
+        key = (board.piece_hash(piece.index), scorer.__name__)
+        placements = cache.get(key)
+        if placements is not None:
+            return placements
+    piece.x = 4
+    placements = tuple(enumerate_placements(piece, board, scorer))
+    if cache is not None:
+        cache.put(key, placements)
+    return placements
+
+
+# Keep the best beam_width nodes, and only the ones within prune of the best one
+# heapq.nsmallest is stable, so equal values keep the order they were generated in
+def select_beam(nodes, beam_width, prune=None):
+    beam = heapq.nsmallest(beam_width, nodes, key=lambda node: node[0])
+    if prune is not None and beam:
+        beam = [node for node in beam if node[0] <= beam[0][0] + prune]
+    return beam
+
+
+# Beam search over the current piece, the preview piece and simulated pieces after those
+# A node is (value, first move, board before the last placement, last placement)
+# Every level keeps at most beam_width nodes, so memory does not grow with the branching factor
+# depth=1 ranks the current piece like depth1_ai, depth=2 with beam_width=10 ranks like depth2_ai
+# Returns up to beam_width first moves sorted by value, best first
+def beam_search(current_piece, next_piece, board, depth=2, beam_width=10, prune=None, rng=None,
+                cache=None):
+    rng = rng or search_random
+    frontier = []
+    for x, y, rotation, value in enumerate_placements(current_piece, board, depth1_value):
+        frontier.append((value, (x, y, rotation), board, (current_piece.index, x, y, rotation)))
+    frontier = select_beam(frontier, beam_width, prune)
+
+    for level in range(1, depth):
+        if level == 1 and next_piece is not None:
+            index = next_piece.index
+        else:
+            index = rng.randrange(len(shapes))
+        piece = Piece(4, 4, shapes[index], index)
+
+        def children(frontier):
+            for value, first, before, last in frontier:
+                after = play_placement(before, *last)
+                for x, y, rotation, child_value in child_placements(after, piece, cache):
+                    yield (weights['next'] * child_value + weights['move'] * value, first, after,
+                           (index, x, y, rotation))
+        frontier = select_beam(children(frontier), beam_width, prune)
+
+    moves = []
+    for value, (x, y, rotation), before, last in frontier:
+        moves.append(Move(x, y, current_piece.shape, rotation, value, current_piece.index))
+    return moves
+
+
+# Policy for Game.run_ai that plays the best move of a beam search
+# Give it a seeded rng to make the simulated pieces reproducible
+def beam_policy(depth=2, beam_width=10, prune=None, rng=None):
+    def policy(game):
+        moves = beam_search(game.current_piece, game.next_piece, game.board, depth, beam_width,
+                            prune, rng, game.cache)
+        if len(moves) == 0:
+            return None
+        return moves[0]
+    return policy
+
+
+# Cost used for a piece that has nowhere to go
+lost_value = 10 ** 7
+# Weight of the expected future against the placement itself, same ratio as depth2_ai's child + 2 * parent
+future_weight = 0.5
+
+
+# Raised inside a search once its deadline has passed
+class SearchTimeout(Exception):
+    pass
+
+
+# Max node: best cost of placing a known piece, looking remaining pieces further ahead
+# Every level is scored with the depth 1 scorer, which also rewards the rows a placement clears,
+# and only the prune_width placements it likes best are expanded
+# With a deadline (a time.perf_counter() value) the search raises SearchTimeout once it has passed
+def max_node(board, index, remaining, prune_width, cache, deadline=None):
+    if deadline is not None and time.perf_counter() > deadline:
+        raise SearchTimeout()
+    piece = Piece(4, 4, shapes[index], index)
+    placements = child_placements(board, piece, cache, depth1_value)
+    ranked = heapq.nsmallest(prune_width, placements, key=lambda p: p[3])
+    if not ranked:
+        return lost_value
+    if remaining == 0:
+        return ranked[0][3]
+    best = None
+    for x, y, rotation, value in ranked:
+        piece.x = x
+        piece.y = y
+        piece.rotation = rotation
+        # The placement is taken back even when the deadline passes further down
+        placement = board.place(piece)
+        try:
+            cost = value + future_weight * chance_node(board, remaining, prune_width, cache, deadline)
+        finally:
+            board.undo(placement)
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+# Chance node: average best cost over the 7 equally likely pieces get_shape can draw
+# Cached per board hash, the same board is never averaged twice while it is in the cache
+def chance_node(board, remaining, prune_width, cache, deadline=None):
+    if cache is not None:
+        key = (board.hash, remaining, prune_width, 'chance')
+        value = cache.get(key)
+        if value is not None:
+            return value
+    total = 0
+    for index in range(len(shapes)):
+        total += max_node(board, index, remaining - 1, prune_width, cache, deadline)
+    value = total / len(shapes)
+    if cache is not None:
+        cache.put(key, value)
+    return value
+
+
+# Expectimax over the current piece, the preview piece and the random pieces after them
+# depth counts placements: 2 is the current and the preview piece, every level above that is a chance node
+# Returns the expanded first moves sorted by expected cost, best first
+def expectimax(current_piece, next_piece, board, depth=3, prune_width=4, cache=None, deadline=None):
+    found = enumerate_placements(current_piece, board, depth1_value)
+    ranked = heapq.nsmallest(prune_width, found, key=lambda p: p[3])
+    piece = Piece(4, 4, current_piece.shape, current_piece.index)
+    moves = []
+    for x, y, rotation, value in ranked:
+        cost = value
+        if depth > 1:
+            piece.x = x
+            piece.y = y
+            piece.rotation = rotation
+            # Every level plays its moves on the one board and takes them back, nothing is copied
+            placement = board.place(piece)
+            try:
+                if next_piece is not None:
+                    future = max_node(board, next_piece.index, depth - 2, prune_width, cache, deadline)
+                else:
+                    future = chance_node(board, depth - 1, prune_width, cache, deadline)
+            finally:
+                board.undo(placement)
+            cost = value + future_weight * future
+        moves.append(Move(x, y, current_piece.shape, rotation, cost, current_piece.index))
+    return sorted(moves, key=lambda x: x.value)
+
+
+# Policy for Game.run_ai that plays the best expectimax move
+def expectimax_policy(depth=3, prune_width=4):
+    def policy(game):
+        moves = expectimax(game.current_piece, game.next_piece, game.board, depth, prune_width,
+                           game.cache)
+        if len(moves) == 0:
+            return None
+        return moves[0]
+    return policy
+
+
+# Iterative deepening expectimax: depth 1, 2, 3, ... until the budget (in seconds) runs out
+# Depth 1 always finishes, a deeper search that runs out of time is thrown away, so the moves
+# of the deepest search that finished are returned. Boards and chance nodes are cached, so every
+# iteration reuses the evaluations of the ones before it.
+# A depth is not started when it would not finish anyway: every depth is guessed to take as many
+# times longer than the last one as the last one took compared to the one before it.
+# Returns (moves, depth reached)
+def anytime_search(current_piece, next_piece, board, budget, max_depth=6, prune_width=4, cache=None):
+    start = time.perf_counter()
+    deadline = start + budget
+    # Placements are enumerated from where the piece is, every iteration starts from the same spot
+    start_x = current_piece.x
+    moves = expectimax(current_piece, next_piece, board, 1, prune_width, cache)
+    reached = 1
+    previous = None
+    last = time.perf_counter() - start
+    for depth in range(2, max_depth + 1):
+        now = time.perf_counter()
+        if previous and now + last * max(last / previous, 2.0) > deadline:
+            break
+        current_piece.x = start_x
+        try:
+            moves = expectimax(current_piece, next_piece, board, depth, prune_width, cache, deadline)
+        except SearchTimeout:
+            break
+        reached = depth
+        previous, last = last, time.perf_counter() - now
+    return moves, reached
+
+
+# Policy for Game.run_ai that searches as deep as a budget of budget_ms milliseconds per piece allows
+# The budget can be changed between decisions, e.g. when the game speeds up. Every decision is kept
+# in decisions as (depth reached, milliseconds), and appended to a JSON lines file if a path is given.
+class AnytimePolicy(object):
+    def __init__(self, budget_ms=100.0, max_depth=6, prune_width=4, path=None):
+        self.budget_ms = budget_ms
+        self.max_depth = max_depth
+        self.prune_width = prune_width
+        self.path = path
+        self.decisions = []
+
+    def __call__(self, game):
+        start = time.perf_counter()
+        budget_ms = self.budget_ms
+        moves, depth = anytime_search(game.current_piece, game.next_piece, game.board, budget_ms / 1000.0,
+                                      self.max_depth, self.prune_width, game.cache)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.decisions.append((depth, elapsed))
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'piece': game.pieces, 'depth': depth, 'ms': elapsed,
+                                    'budget_ms': budget_ms}) + '\n')
+        if len(moves) == 0:
+            return None
+        return moves[0]
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+from ai import depth1_policy, depth1_reachable_policy, depth2_policy
+from board import Board, board_width
+from cache import LRUCache
+from game import Game, Piece, drop_piece, eval_cache_size, shapes, valid_space
+
+# Match server: many independent headless games in one process, played by bots over a socket
+# The protocol is one line of ASCII per message. Every connection plays one game at a time.
+#   client  NEW [seed]          start a game, with a random seed if none is given
+#           PLACE rotation x [y] place the current piece, without y it is dropped straight down
+#                               a y has to be a row the piece rests in, it can not float or hang above the grid
+#           STATS               aggregate numbers of the server
+#           QUIT
+#   server  HELLO tetris 1
+#           GAME seed
+#           STATE pieces score lines current next rows   rows are the 20 row bitmasks in hex, top first
+#           OVER score lines pieces
+#           STATS connections games active pieces pieces_per_s
+#           ERR message
+# The server only sends a state after a placement came in, so a bot can never fall behind by more than
+# one message. Writes wait for the socket buffer to drain, and a client that does not read or does not
+# answer within its timeout is disconnected.
+protocol_version = 1
+# Longest line a client may send
+max_line = 256
+
+
+# Position of a game as a STATE line
+def format_state(game):
+    rows = ','.join('%x' % row for row in game.board.rows)
+    return 'STATE %d %d %d %d %d %s' % (game.pieces, game.score, game.lines, game.current_piece.index,
+                                        game.next_piece.index, rows)
+
+
+# Position of a STATE line with everything the built-in policies read from a Game
+# The evaluation cache is passed in, so a bot keeps one for all the positions it searches
+class Position(object):
+    def __init__(self, board, current_piece, next_piece, pieces, score, lines, cache):
+        self.board = board
+        self.current_piece = current_piece
+        self.next_piece = next_piece
+        self.queue = [next_piece]
+        self.pieces = pieces
+        self.score = score
+        self.lines = lines
+        self.cache = cache
+
+
+def parse_state(line, cache=None):
+    parts = line.split()
+    pieces, score, lines, current, following = (int(part) for part in parts[1:6])
+    rows = [int(row, 16) for row in parts[6].split(',')]
+    board = Board(dict(((x, y), (0, 0, 0)) for y, row in enumerate(rows)
+                       for x in range(board_width) if (row >> x) & 1))
+    return Position(board, Piece(5, 0, shapes[current], current), Piece(5, 0, shapes[following], following),
+                    pieces, score, lines, cache)
+
+
+# Play a PLACE command on a game, raises ValueError if the placement is not valid
+def place(game, args):
+    if len(args) not in (2, 3):
+        raise ValueError('PLACE needs rotation, x and optionally y')
+    rotation, x = int(args[0]), int(args[1])
+    piece = game.current_piece
+    piece.rotation = rotation
+    piece.x = x
+    compiled = piece.compiled()
+    if x + compiled.left < 0 or x + compiled.right >= board_width:
+        raise ValueError('piece does not fit between the walls at x %d' % x)
+    if len(args) == 3:
+        piece.y = int(args[2])
+        # Gravity applies to bots as well: the piece has to fit and be unable to fall any further
+        if valid_space(piece, game.board):
+            piece.y += 1
+            resting = not valid_space(piece, game.board)
+            piece.y -= 1
+            if not resting:
+                raise ValueError('piece is not resting on anything at y %d' % piece.y)
+    else:
+        # Pieces spawn above the grid, drop it from there
+        piece.y = 0
+        drop_piece(piece, game.board)
+    game.step(piece)
+
+
+class MatchServer(object):
+    def __init__(self, move_timeout=10.0, write_timeout=10.0, idle_timeout=60.0):
+        # Seconds a client may take to answer a state, to read what was sent and to start a game
+        self.move_timeout = move_timeout
+        self.write_timeout = write_timeout
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.games = 0
+        self.active = 0
+        self.pieces = 0
+        self.start = time.perf_counter()
+        self.report_pieces = 0
+        self.report_start = self.start
+
+    def stats_line(self):
+        elapsed = time.perf_counter() - self.start
+        return 'STATS %d %d %d %d %.1f' % (self.connections, self.games, self.active, self.pieces,
+                                           self.pieces / elapsed if elapsed else 0.0)
+
+    # Pieces per second since the last report
+    def report(self):
+        now = time.perf_counter()
+        rate = (self.pieces - self.report_pieces) / (now - self.report_start)
+        self.report_pieces = self.pieces
+        self.report_start = now
+        return '%d connections, %d games running, %d played, %.0f pieces/s' % (
+            self.connections, self.active, self.games, rate)
+
+    # Send a line and wait until the client has taken it, so a slow client slows only itself down
+    async def send(self, writer, line):
+        writer.write(line.encode() + b'\n')
+        await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        game = None
+        try:
+            await self.send(writer, 'HELLO tetris %d' % protocol_version)
+            while True:
+                timeout = self.idle_timeout if game is None else self.move_timeout
+                try:
+                    data = await asyncio.wait_for(reader.readline(), timeout)
+                except asyncio.TimeoutError:
+                    await self.send(writer, 'ERR timeout')
+                    break
+                except ValueError:
+                    # The line is longer than the stream limit
+                    await self.send(writer, 'ERR line too long')
+                    break
+                if not data:
+                    break
+                parts = data.decode('ascii', 'replace').split()
+                if not parts:
+                    continue
+                command, args = parts[0].upper(), parts[1:]
+                if command == 'QUIT':
+                    break
+                elif command == 'STATS':
+                    await self.send(writer, self.stats_line())
+                elif command == 'NEW':
+                    if game is not None:
+                        self.active -= 1
+                    try:
+                        seed = int(args[0]) if args else random.randrange(2 ** 32)
+                    except ValueError:
+                        await self.send(writer, 'ERR bad seed')
+                        game = None
+                        continue
+                    game = Game(seed=seed)
+                    self.games += 1
+                    self.active += 1
+                    await self.send(writer, 'GAME %d' % seed)
+                    await self.send(writer, format_state(game))
+                elif command == 'PLACE':
+                    if game is None:
+                        await self.send(writer, 'ERR no game, send NEW first')
+                        continue
+                    try:
+                        place(game, args)
+                    except ValueError as e:
+                        # The piece is not played, the client can try another placement
+                        await self.send(writer, 'ERR %s' % e)
+                        continue
+                    self.pieces += 1
+                    if game.over:
+                        self.active -= 1
+                        await self.send(writer, 'OVER %d %d %d' % (game.score, game.lines, game.pieces))
+                        game = None
+                    else:
+                        await self.send(writer, format_state(game))
+                else:
+                    await self.send(writer, 'ERR unknown command %s' % command)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            if game is not None:
+                self.active -= 1
+            self.connections -= 1
+            writer.close()
+
+    # Serve on a TCP port, or on a Unix socket if a path is given, until cancelled
+    # Prints the aggregate pieces per second every report_every seconds
+    async def serve(self, host='127.0.0.1', port=4701, path=None, report_every=5.0):
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path, limit=max_line)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=max_line)
+        async with server:
+            while True:
+                await asyncio.sleep(report_every)
+                print(self.report(), flush=True)
+
+
+# Policies the built-in bot can play with
+bot_policies = {'depth1': depth1_policy, 'depth1_reachable': depth1_reachable_policy, 'depth2': depth2_policy}
+
+
+# Built-in bot: plays games on the server with one of the built-in policies
+# A game that reaches max_pieces is given up so good policies do not play forever
+# Returns (seed, score, lines, pieces) of every game
+async def run_bot(policy, games, host='127.0.0.1', port=4701, path=None, seed=None, max_pieces=None):
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    results = []
+    # Evaluations are shared by every position the bot searches, the same as in one Game
+    cache = LRUCache(eval_cache_size)
+    try:
+        line = (await reader.readline()).decode()
+        if not line.startswith('HELLO'):
+            raise ConnectionError('unexpected greeting %r' % line)
+        for n in range(games):
+            writer.write(b'NEW\n' if seed is None else b'NEW %d\n' % (seed + n))
+            game_seed = int((await reader.readline()).split()[1])
+            while True:
+                line = (await reader.readline()).decode()
+                if line.startswith('OVER'):
+                    results.append((game_seed,) + tuple(int(part) for part in line.split()[1:4]))
+                    break
+                if not line.startswith('STATE'):
+                    raise ConnectionError('unexpected reply %r' % line)
+                game = parse_state(line, cache)
+                if max_pieces is not None and game.pieces >= max_pieces:
+                    results.append((game_seed, game.score, game.lines, game.pieces))
+                    break
+                move = policy(game)
+                if move is None:
+                    # No valid placement left, play the first one that fits between the walls
+                    writer.write(b'PLACE 0 5\n')
+                else:
+                    writer.write(b'PLACE %d %d %d\n' % (move.rotation, move.x, move.y))
+                await writer.drain()
+        writer.write(b'QUIT\n')
+        await writer.drain()
+    finally:
+        writer.close()
+    return results
+
+
+async def run_bots(policy, bots, games, host, port, path, seed, max_pieces):
+    tasks = [run_bot(policy, games, host, port, path, None if seed is None else seed + i * games, max_pieces)
+             for i in range(bots)]
+    return await asyncio.gather(*tasks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve headless Tetris games to bots, or run the built-in bot')
+    parser.add_argument('command', choices=['serve', 'bot'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4701)
+    parser.add_argument('--unix', metavar='PATH', help='use a Unix socket instead of TCP')
+    parser.add_argument('--move-timeout', type=float, default=10.0)
+    parser.add_argument('--report', type=float, default=5.0, help='seconds between pieces/s reports')
+    parser.add_argument('--policy', choices=sorted(bot_policies), default='depth1')
+    parser.add_argument('--bots', type=int, default=1, help='bots to run at once')
+    parser.add_argument('--games', type=int, default=1, help='games every bot plays')
+    parser.add_argument('--seed', type=int, help='seed of the first game, random seeds if left out')
+    parser.add_argument('--max-pieces', type=int, default=1000, help='pieces per game at most')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = MatchServer(move_timeout=args.move_timeout)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix, args.report))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    start = time.perf_counter()
+    results = asyncio.run(run_bots(bot_policies[args.policy], args.bots, args.games, args.host,
+                                   args.port, args.unix, args.seed, args.max_pieces))
+    elapsed = time.perf_counter() - start
+    games = [game for bot in results for game in bot]
+    pieces = sum(game[3] for game in games)
+    for seed, score, lines, played in games:
+        print('seed %d: score %d, %d lines, %d pieces' % (seed, score, lines, played))
+    print('%d games, %d pieces, %.0f pieces/s' % (len(games), pieces, pieces / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
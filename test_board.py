@@ -0,0 +1,109 @@
+import random
+from ai import depth1_ai
+from board import board_height, board_width
+from game import Game, Piece, convert_shape_format, shapes
+
+# Checks of the incremental Board features against a full rescan of the rows, and of place and undo
+
+
+# Every feature of a board computed from scratch out of its row bitmasks
+def rescan(board):
+    occupied = [[(board.rows[y] >> x) & 1 for x in range(board_width)] for y in range(board_height)]
+    heights = []
+    cols = []
+    for x in range(board_width):
+        column = [occupied[y][x] for y in range(board_height)]
+        top = column.index(1) if 1 in column else board_height
+        heights.append(board_height - top)
+        cols.append(sum(1 << (board_height - 1 - y) for y in range(board_height) if column[y]))
+    row_fill = [sum(row) for row in occupied]
+    blocks = sum(row_fill)
+    return {
+        'cols': cols,
+        'heights': heights,
+        'row_fill': row_fill,
+        'blocks': blocks,
+        'holes': sum(heights) - blocks,
+        'bumpiness': sum(abs(heights[i] - heights[i + 1]) for i in range(board_width - 1)),
+        'hash': board.compute_hash(),
+    }
+
+
+# The features the board keeps up to date itself
+def features(board):
+    return {
+        'cols': list(board.cols),
+        'heights': list(board.heights),
+        'row_fill': list(board.row_fill),
+        'blocks': board.blocks,
+        'holes': board.holes,
+        'bumpiness': board.bumpiness,
+        'hash': board.hash,
+    }
+
+
+# Seeded self-play that mixes the best depth 1 move with random ones, so stacks get holes and overhangs
+def self_play(seed, max_pieces=200):
+    rng = random.Random(seed)
+    game = Game(seed=seed)
+    while not game.over and game.pieces < max_pieces:
+        moves = depth1_ai(game.current_piece, game.next_piece, game.board, game.board.colors)
+        if not moves:
+            break
+        game.step(moves[0] if rng.random() < 0.7 else rng.choice(moves))
+        yield game
+
+
+def test_features_match_rescan_after_every_lock():
+    cleared = 0
+    holes = 0
+    for seed in range(30):
+        for game in self_play(seed):
+            assert features(game.board) == rescan(game.board)
+            holes += game.board.holes > 0
+        cleared += game.lines
+    # The run has to clear rows and leave holes, or those paths were not checked
+    assert cleared > 0
+    assert holes > 0
+
+
+# Everything place and undo touch, the colors included
+def state(board):
+    return (features(board), list(board.rows), dict(board.colors))
+
+
+def test_place_matches_lock_and_clear_and_undo_restores():
+    rng = random.Random(4701)
+    placements = 0
+    clears = 0
+    for seed in range(20):
+        for game in self_play(seed, 100):
+            board = game.board
+            before = state(board)
+            # Stack up to 3 placements, each compared to lock and clear_rows on a copy, then undo them all
+            reference = board.copy()
+            stack = []
+            for _ in range(3):
+                index = rng.randrange(len(shapes))
+                piece = Piece(4, 4, shapes[index], index)
+                moves = depth1_ai(piece, None, board, board.colors)
+                if not moves:
+                    break
+                move = rng.choice(moves)
+                piece.x, piece.y, piece.rotation = move.x, move.y, move.rotation
+                reference.lock(convert_shape_format(piece), (0, 0, 1))
+                cleared = reference.clear_rows()
+                previous = state(board)
+                placement = board.place(piece)
+                assert placement.cleared == cleared
+                assert state(board) == state(reference)
+                assert features(board) == rescan(board)
+                stack.append((placement, previous))
+                placements += 1
+                clears += cleared > 0
+            for placement, previous in reversed(stack):
+                board.undo(placement)
+                assert state(board) == previous
+            assert state(board) == before
+    assert placements > 0
+    assert clears > 0
@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ai
+from game import Game
+
+# Cross-entropy tuning of the depth 1 evaluation weights
+# Every generation samples weight vectors around the current mean, plays the same seeded
+# headless games with each of them on a process pool and moves the mean towards the best ones.
+# Candidates of different generations play different seeds, so their scores can not be compared.
+# Instead the new mean of every generation plays a fixed held-out set of seeds, and the mean that
+# did best on those is written as a config that ai.load_weights can read.
+# Progress is checkpointed to disk after every generation.
+
+# Weights that are tuned by default, the ones depth1_ai uses
+tuned_keys = ['bump', 'height', 'rows', 'gaps']
+
+
+# Runs in a worker: play one seeded depth 1 game with the given weights and return the lines cleared
+def play_game(task):
+    weights, seed, max_pieces = task
+    ai.set_weights(weights)
+    game = Game(seed=seed)
+    game.run_ai(ai.depth1_policy, max_pieces)
+    return game.lines
+
+
+# Average lines of every candidate, all candidates play the same seeds so they are compared fairly
+def evaluate(pool, candidates, seeds, max_pieces, workers=None):
+    tasks = [(weights, seed, max_pieces) for weights in candidates for seed in seeds]
+    chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+    results = list(pool.map(play_game, tasks, chunksize=chunksize))
+    fitness = []
+    for i in range(len(candidates)):
+        games = results[i * len(seeds):(i + 1) * len(seeds)]
+        fitness.append(sum(games) / len(games))
+    return fitness
+
+
+# Starting state of the search, centered on the current weights
+def initial_state(keys):
+    return {
+        'generation': 0,
+        'keys': keys,
+        'mean': [float(ai.default_weights[key]) for key in keys],
+        'std': [max(1.0, ai.default_weights[key] / 2.0) for key in keys],
+        'best_weights': dict((key, ai.default_weights[key]) for key in keys),
+        # Average lines of best_weights on the held-out seeds
+        'best_holdout': None,
+        'history': [],
+    }
+
+
+# Weight vector as a config dict, negative weights are clipped to 0
+def to_weights(keys, vector):
+    return dict((key, max(0.0, value)) for key, value in zip(keys, vector))
+
+
+def load_checkpoint(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Write the checkpoint to a temporary file first so a crash never leaves half a checkpoint
+def save_checkpoint(path, state):
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp, path)
+
+
+def tune(generations=20, population=24, elite=0.25, games=4, max_pieces=300, seed=0,
+         workers=None, checkpoint='tune_checkpoint.json', out='weights.json', resume=True, holdout=8):
+    if resume and checkpoint and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+    else:
+        state = initial_state(tuned_keys)
+    keys = state['keys']
+    n_elite = max(1, int(population * elite))
+    # The held-out seeds never change and come from their own generator, so no generation trains on them
+    holdout_rng = random.Random('holdout %d' % seed)
+    holdout_seeds = [holdout_rng.randrange(2 ** 31) for _ in range(holdout)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while state['generation'] < generations:
+            generation = state['generation']
+            # Every generation has its own sampling and game seeds, so a resumed run continues the same way
+            rng = random.Random(seed * 100003 + generation)
+            seeds = [rng.randrange(2 ** 31) for _ in range(games)]
+            vectors = [[rng.gauss(m, s) for m, s in zip(state['mean'], state['std'])]
+                       for _ in range(population)]
+            candidates = [to_weights(keys, vector) for vector in vectors]
+
+            start = time.perf_counter()
+            fitness = evaluate(pool, candidates, seeds, max_pieces, workers)
+            elapsed = time.perf_counter() - start
+
+            ranked = sorted(range(population), key=lambda i: fitness[i], reverse=True)
+            elites = [vectors[i] for i in ranked[:n_elite]]
+            for k in range(len(keys)):
+                values = [vector[k] for vector in elites]
+                mean = sum(values) / len(values)
+                variance = sum((v - mean) ** 2 for v in values) / len(values)
+                state['mean'][k] = mean
+                # A small noise floor keeps the search from collapsing too early
+                state['std'][k] = max(variance ** 0.5, 0.05 * abs(mean), 0.1)
+
+            # Only scores on the same held-out seeds are compared across generations
+            mean_weights = to_weights(keys, state['mean'])
+            holdout_fitness = evaluate(pool, [mean_weights], holdout_seeds, max_pieces, workers)[0]
+            if state['best_holdout'] is None or holdout_fitness > state['best_holdout']:
+                state['best_holdout'] = holdout_fitness
+                state['best_weights'] = mean_weights
+            state['history'].append({
+                'generation': generation,
+                'best_fitness': fitness[ranked[0]],
+                'mean_fitness': sum(fitness) / len(fitness),
+                'holdout_fitness': holdout_fitness,
+                'games_per_min': population * games / elapsed * 60,
+            })
+            state['generation'] = generation + 1
+            if checkpoint:
+                save_checkpoint(checkpoint, state)
+            if out:
+                ai.save_weights(out, state['best_weights'])
+            print(json.dumps(state['history'][-1]))
+            sys.stdout.flush()
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tune the depth 1 evaluation weights with the cross-entropy method')
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--population', type=int, default=24, help='weight vectors per generation')
+    parser.add_argument('--elite', type=float, default=0.25, help='fraction of candidates the mean moves to')
+    parser.add_argument('--games', type=int, default=4, help='seeded games per candidate')
+    parser.add_argument('--max-pieces', type=int, default=300, help='pieces per game at most')
+    parser.add_argument('--holdout', type=int, default=8, help='held-out games the mean of every generation plays')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--checkpoint', default='tune_checkpoint.json')
+    parser.add_argument('--out', default='weights.json', help='where the best weights are written')
+    parser.add_argument('--fresh', action='store_true', help='ignore an existing checkpoint')
+    args = parser.parse_args(argv)
+    state = tune(args.generations, args.population, args.elite, args.games, args.max_pieces, args.seed,
+                 args.workers, args.checkpoint, args.out, not args.fresh, args.holdout)
+    print(json.dumps({'best_holdout': state['best_holdout'], 'best_weights': state['best_weights']}))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,206 @@
+import numpy as np
+from ai import Move, depth1_value, weights
+from board import board_height, board_width
+from game import Piece, drop_piece, shape_table, shapes
+
+# Most blocks a piece has in a single row or column
+max_span = 4
+# Row enumerate_placements moves the piece along before dropping it
+sweep_row = 4
+
+
+# Every (rotation, column) placement of one shape with the static data the heuristics need
+# Each row of the arrays is one candidate, padded columns are switched off with col_valid
+class PlacementTable(object):
+    def __init__(self, rotations):
+        rot, xs, cell_col, cell_dy, top = [], [], [], [], []
+        col_x, col_valid, col_top, col_count, left_open, right_step, row_count = [], [], [], [], [], [], []
+        # (first candidate, lowest x, highest x) of every rotation
+        self.spans = []
+        for r, rotation in enumerate(rotations):
+            cells = set(rotation.cells)
+            self.spans.append((len(rot), -rotation.left, board_width - 1 - rotation.right))
+            for x in range(-rotation.left, board_width - rotation.right):
+                rot.append(r)
+                xs.append(x)
+                cell_col.append([x + dx for dx, dy in rotation.cells])
+                cell_dy.append([dy for dx, dy in rotation.cells])
+                top.append(rotation.top)
+                cx, cv, ct, cc, lo, rs = [], [], [], [], [], []
+                for c in range(max_span):
+                    if c < rotation.width:
+                        dx = rotation.left + c
+                        dy = rotation.tops[c]
+                        cx.append(x + dx)
+                        cv.append(True)
+                        ct.append(dy)
+                        cc.append(rotation.bottoms[c] - dy + 1)
+                        # The parts of heur_bump that only depend on the piece itself
+                        lo.append((dx - 1, dy) not in cells and (dx - 1, dy - 1) not in cells)
+                        rs.append((dx + 1, dy) not in cells and (dx + 1, dy - 1) in cells)
+                    else:
+                        cx.append(0)
+                        cv.append(False)
+                        ct.append(0)
+                        cc.append(0)
+                        lo.append(False)
+                        rs.append(False)
+                col_x.append(cx)
+                col_valid.append(cv)
+                col_top.append(ct)
+                col_count.append(cc)
+                left_open.append(lo)
+                right_step.append(rs)
+                row_count.append([bin(mask).count('1') for dy, mask in rotation.row_masks] +
+                                 [0] * (max_span - rotation.height))
+        self.rotation = np.array(rot)
+        self.x = np.array(xs)
+        self.cell_col = np.array(cell_col)
+        self.cell_dy = np.array(cell_dy)
+        self.top = np.array(top)
+        self.col_x = np.array(col_x)
+        self.col_valid = np.array(col_valid)
+        self.col_top = np.array(col_top)
+        self.col_count = np.array(col_count)
+        self.left_open = np.array(left_open)
+        self.right_step = np.array(right_step)
+        self.row_count = np.array(row_count)
+
+
+# Placement tables for every shape, indexed the same way as shapes
+placement_tables = [PlacementTable(rotations) for rotations in shape_table]
+
+# Bit of every column, used to unpack the row bitmasks
+column_bits = 1 << np.arange(board_width)
+
+
+# Occupancy of the board as a (20, 10) boolean array
+def board_array(board):
+    return (np.array(board.rows)[:, None] & column_bits) != 0
+
+
+# Score every placement of a shape in one pass
+# Returns a dict of arrays with one entry per (rotation, column) pair, in enumeration order
+def evaluate_placements(board, index):
+    table = placement_tables[index]
+    occ = board_array(board)
+    # Row index of the highest block in every column, board_height if the column is empty
+    surface = np.where(occ.any(axis=0), occ.argmax(axis=0), board_height)
+    fill = occ.sum(axis=1)
+
+    # Landing row: the lowest y where every block is still above its column's surface
+    y = (surface[table.cell_col] - 1 - table.cell_dy).min(axis=1)
+
+    # Placements the piece can be moved into at sweep_row, blocks above the grid always fit
+    sweep_rows = sweep_row + table.cell_dy
+    fits = ((sweep_rows < 0) | ~occ[np.clip(sweep_rows, 0, board_height - 1), table.cell_col]).all(axis=1)
+
+    # heur_height: height of the highest block of the piece
+    height = (board_height - (y + table.top)) * -10
+
+    # heur_rows: rows completed by the piece plus rows that are already full
+    rows = y[:, None] + table.top[:, None] + np.arange(max_span)
+    on_board = (rows >= 0) & (rows < board_height) & (table.row_count > 0)
+    filled = fill[np.clip(rows, 0, board_height - 1)] + table.row_count
+    lines = (on_board & (filled == board_width)).sum(axis=1) + (fill == board_width).sum()
+    rows_value = lines * 190
+
+    # heur_gaps: empty cells between the top block of each column and the surface
+    # Columns starting above the grid count nothing, same as the scalar version
+    col_row = y[:, None] + table.col_top
+    counted = table.col_valid & (col_row >= 0)
+    gaps = np.where(counted, surface[table.col_x] - col_row - table.col_count, 0).sum(axis=1)
+    gaps_value = gaps * -50
+
+    # heur_bump: empty lookups go through a padded board where everything off the grid is taken
+    empty = np.zeros((board_height + 2, board_width + 2), dtype=bool)
+    empty[1:-1, 1:-1] = ~occ
+
+    def is_empty(cols, rws):
+        inside = (rws >= -1) & (rws <= board_height)
+        return inside & empty[np.clip(rws + 1, 0, board_height + 1), cols + 1]
+
+    left = table.col_x - 1
+    right = table.col_x + 1
+    bump = 2 * (table.left_open & is_empty(left, col_row - 1) & is_empty(left, col_row))
+    bump += 2 * (table.right_step & is_empty(right, col_row - 1) & is_empty(right, col_row))
+    bump += table.col_valid & (right == board_width)
+    bump += table.col_valid & (left == 0)
+    bump_value = bump.sum(axis=1) * -20
+
+    w = weights
+    value = -1 * (w['bump'] * bump_value + w['height'] * height + w['rows'] * rows_value + w['gaps'] * gaps_value)
+    return {'rotation': table.rotation, 'x': table.x, 'y': y, 'fits': fits, 'height': height,
+            'gaps': gaps_value, 'rows': rows_value, 'bump': bump_value, 'value': value}
+
+
+# Candidates enumerate_placements visits, as (candidate, rotation) in the order it first finds them
+# The sweep is replayed on the fits array: every rotation slides left and then right along sweep_row
+# from where it starts, so only the columns connected to the start are found, and a rotation that
+# does not fit at column 4 is skipped by sweeping the previous rotation again. Rotations count up
+# past the last one the same way, so rotation may be len(rotations) for a second pass of rotation 0.
+def sweep_candidates(table, fits, start_x):
+    spans = table.spans
+    visited = []
+    seen = set()
+
+    def valid(rotation, x):
+        first, low, high = spans[rotation % len(spans)]
+        return low <= x <= high and fits[first + x - low]
+
+    rotation = 0
+    x = start_x
+    for _ in range(len(spans) + 1):
+        while valid(rotation, x):
+            x -= 1
+        x += 1
+        while valid(rotation, x):
+            first, low, high = spans[rotation % len(spans)]
+            candidate = first + x - low
+            if candidate not in seen:
+                seen.add(candidate)
+                visited.append((candidate, rotation))
+            x += 1
+        x = 4
+        rotation += 1
+        if not valid(rotation, 4):
+            rotation -= 1
+    return visited
+
+
+# Vectorized version of depth1_ai, returns the same moves sorted by value the same way
+# The board is scored in one pass, then the sweep of enumerate_placements is replayed to keep only
+# the placements it reaches. A placement whose drop from sweep_row starts under an overhang is tucked
+# below it by the scalar drop, those few are dropped and scored with the scalar code.
+# Repeated placements are only returned once, the best move is the same as depth1_ai's.
+def depth1_ai_vectorized(current_piece, next_piece, board, locked_positions):
+    table = placement_tables[current_piece.index]
+    scores = evaluate_placements(board, current_piece.index)
+    visited = sweep_candidates(table, scores['fits'].tolist(), current_piece.x)
+    xs = scores['x'].tolist()
+    ys = scores['y'].tolist()
+    values = scores['value'].tolist()
+    found = []
+    for candidate, rotation in visited:
+        x = xs[candidate]
+        y = ys[candidate]
+        value = values[candidate]
+        if y < sweep_row:
+            piece = Piece(x, sweep_row, shapes[current_piece.index], current_piece.index)
+            piece.rotation = rotation
+            drop_piece(piece, board)
+            y = piece.y
+            value = depth1_value(piece, board)
+        found.append((value, x, y, rotation))
+    # A stable sort keeps enumeration order between equal values, like sorted() does
+    found.sort(key=lambda placement: placement[0])
+    return [Move(x, y, current_piece.shape, rotation, value, current_piece.index)
+            for value, x, y, rotation in found]
+
+
+# Policy for Game.run_ai that plays the best vectorized depth 1 move
+def depth1_vectorized_policy(game):
+    moves = depth1_ai_vectorized(game.current_piece, game.next_piece, game.board, game.board.colors)
+    if len(moves) == 0:
+        return None
+    return moves[0]
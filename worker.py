@@ -0,0 +1,141 @@
+import queue
+import threading
+
+
+# Search for a predicted position that was started before the game got there
+class Speculation(object):
+    def __init__(self, key, policy, game):
+        self.key = key
+        self.policy = policy
+        self.game = game
+        self.done = False
+        self.move = None
+        # Set once the game loop asks for this position
+        self.generation = None
+        self.speculate = False
+
+
+# Runs AI searches on a background thread so the game loop keeps drawing and reading input
+# Every request is tagged with a generation number. Submitting or cancelling bumps the generation,
+# so requests that have not started yet are skipped and results of older requests are dropped.
+# A search that is already running can not be interrupted, it finishes and its result is thrown away.
+#
+# With speculate on, the worker does not wait for the next request after a move is found:
+# it plays the move on a copy of the game (Game.predict) and searches the position the game
+# will be in once the next piece spawns. If the game loop then asks for exactly that position
+# with the same policy, the result is handed over without searching again. If the player did
+# something else, the keys do not match and the speculative result is thrown away.
+class AIWorker(object):
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.busy = False
+        # Guards the speculation, it is shared by the game loop and the worker thread
+        self.lock = threading.Lock()
+        self.speculation = None
+        # Requests answered by a speculative search, and requests that had to be searched
+        self.hits = 0
+        self.misses = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Start a search, policy is called with the game on the worker thread
+    # The game should be a snapshot (Game.snapshot) the game loop does not touch anymore
+    def submit(self, policy, game, speculate=False):
+        key = game.position_key()
+        with self.lock:
+            self.generation += 1
+            self.busy = True
+            spec = self.speculation
+            self.speculation = None
+            if spec is not None and spec.key == key and spec.policy is policy:
+                self.hits += 1
+                if spec.done:
+                    # Keep speculating from the position that was just handed over
+                    following = self.publish(self.generation, policy, spec.game, speculate, spec.move)
+                    if following is not None:
+                        self.requests.put(following)
+                else:
+                    # Still running, the worker hands the result over when it is done
+                    spec.generation = self.generation
+                    spec.speculate = speculate
+                    self.speculation = spec
+                return self.generation
+            self.misses += 1
+            self.requests.put((self.generation, policy, game, speculate))
+            return self.generation
+
+    # Forget the current request and any speculation, their results will never be returned
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.busy = False
+            self.speculation = None
+
+    # Result of the current request if it has finished, as (True, move), otherwise (False, None)
+    # The move is None if the policy found no valid move
+    def poll(self):
+        while True:
+            try:
+                generation, move = self.results.get_nowait()
+            except queue.Empty:
+                return False, None
+            if generation == self.generation:
+                self.busy = False
+                return True, move
+
+    # Stop the thread after the search that is running, if any
+    def stop(self):
+        self.cancel()
+        self.requests.put(None)
+
+    # Every search goes through here, so a profiler can time each decision
+    def search(self, policy, game):
+        return policy(game)
+
+    # Hand a move over to the game loop, called with the lock held
+    # The speculation for the position after the move is registered before the move is put on results,
+    # so a game loop that plays the move and submits the next position right away always finds it.
+    # Returns the speculation that still has to be searched, None if there is nothing to search
+    def publish(self, generation, policy, game, speculate, move):
+        if generation != self.generation:
+            return None
+        spec = None
+        if speculate and move is not None:
+            predicted = game.predict(move)
+            if not predicted.over:
+                spec = Speculation(predicted.position_key(), policy, predicted)
+        self.speculation = spec
+        self.results.put((generation, move))
+        return spec
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            if isinstance(request, Speculation):
+                spec = request
+                with self.lock:
+                    # Thrown away before it started
+                    if self.speculation is not spec:
+                        continue
+            else:
+                generation, policy, game, speculate = request
+                # Cancelled or replaced before it started
+                if generation != self.generation:
+                    continue
+                move = self.search(policy, game)
+                with self.lock:
+                    spec = self.publish(generation, policy, game, speculate, move)
+            # Search one move ahead of the game loop until it stops asking for the predicted positions
+            while spec is not None:
+                move = self.search(spec.policy, spec.game)
+                with self.lock:
+                    spec.move = move
+                    spec.done = True
+                    # Not asked for yet, submit hands the result over and speculates further
+                    if spec.generation is None or self.speculation is not spec:
+                        break
+                    spec = self.publish(spec.generation, spec.policy, spec.game, spec.speculate, move)